@@ -1,28 +1,106 @@
-from flask import Flask, request, jsonify, render_template_string, Response
+from flask import Flask, Blueprint, request, jsonify, render_template_string, Response, g, current_app, make_response
 from flask_cors import CORS
+from werkzeug.exceptions import BadRequest, HTTPException, RequestEntityTooLarge
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import wraps
 import requests
+import argparse
+import codecs
+import hashlib
+import http.client
 import json
 import logging
+import math
 import os
+import queue
+import random
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+try:
+    import redis
+except ImportError:  # Optional: only needed for a shared rate-limit backend
+    redis = None
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
 class Config:
-    OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
-    MODEL_NAME = os.getenv('MODEL_NAME', 'gemma3:1b')
-    FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
-    FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
-    DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+    """Application settings, loaded into each app's ``config`` by ``create_app``."""
+
+    @staticmethod
+    def from_env():
+        """Read every setting from the environment (and a loaded ``.env`` file)."""
+        return {
+            'OLLAMA_BASE_URL': os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434'),
+            'MODEL_NAME': os.getenv('MODEL_NAME', 'gemma3:1b'),
+            'FLASK_PORT': int(os.getenv('FLASK_PORT', 5000)),
+            'FLASK_HOST': os.getenv('FLASK_HOST', '0.0.0.0'),
+            'DEBUG': os.getenv('DEBUG', 'True').lower() == 'true',
+
+            # Production server (see `serve`)
+            'WORKERS': int(os.getenv('WORKERS', os.cpu_count() or 1)),
+            'THREADS': int(os.getenv('THREADS', 4)),
+            'GRACEFUL_TIMEOUT': int(os.getenv('GRACEFUL_TIMEOUT', 30)),
+
+            # Request limits: body size in bytes, history length, characters per message
+            'MAX_CONTENT_LENGTH': int(os.getenv('MAX_CONTENT_LENGTH', 512 * 1024)),
+            'MAX_HISTORY_MESSAGES': int(os.getenv('MAX_HISTORY_MESSAGES', 50)),
+            'MAX_MESSAGE_CHARS': int(os.getenv('MAX_MESSAGE_CHARS', 32000)),
+            'MAX_JSON_VALUES': int(os.getenv('MAX_JSON_VALUES', 10000)),
+
+            # Traffic recording for replay_traffic.py (disabled when no path is set)
+            'TRAFFIC_LOG_PATH': os.getenv('TRAFFIC_LOG_PATH', ''),
+            'TRAFFIC_LOG_REDACT': os.getenv('TRAFFIC_LOG_REDACT', 'True').lower() == 'true',
+            'TRAFFIC_LOG_SAMPLE': float(os.getenv('TRAFFIC_LOG_SAMPLE', 1.0)),
+
+            # Comma-separated list of other origins allowed to call the API ('*' allows every
+            # origin); empty keeps the API same-origin
+            'CORS_ORIGINS': [o.strip() for o in os.getenv('CORS_ORIGINS', '').split(',') if o.strip()],
+
+            # Seconds a shared Ollama status probe is reused (and how often status streams reconnect)
+            'STATUS_INTERVAL': int(os.getenv('STATUS_INTERVAL', 10)),
+
+            # Retries allowed when structured output diverges from its schema
+            'STRUCTURED_MAX_RETRIES': int(os.getenv('STRUCTURED_MAX_RETRIES', 2)),
+
+            # Durable job queue for long generations (/api/jobs)
+            'JOBS_DB_PATH': os.getenv('JOBS_DB_PATH', 'jobs.db'),
+            'JOBS_WORKERS': int(os.getenv('JOBS_WORKERS', 2)),
+            'JOBS_LEASE': int(os.getenv('JOBS_LEASE', 60)),
+            'JOBS_RETENTION': int(os.getenv('JOBS_RETENTION', 86400)),
+            'JOBS_CALLBACK_HOSTS': [h.strip() for h in os.getenv('JOBS_CALLBACK_HOSTS', 'localhost,127.0.0.1,::1').split(',') if h.strip()],
+
+            # Multi-model comparison (/api/chat/compare)
+            'COMPARE_MAX_MODELS': int(os.getenv('COMPARE_MAX_MODELS', 4)),
+
+            # Response cache and speculative prefetch of likely follow-ups
+            'RESPONSE_CACHE_SIZE': int(os.getenv('RESPONSE_CACHE_SIZE', 256)),
+            'RESPONSE_CACHE_TTL': int(os.getenv('RESPONSE_CACHE_TTL', 600)),
+            'PREFETCH_ENABLED': os.getenv('PREFETCH_ENABLED', 'False').lower() == 'true',
+            'PREFETCH_TOP_K': int(os.getenv('PREFETCH_TOP_K', 2)),
+            'PREFETCH_SUGGESTIONS_FILE': os.getenv('PREFETCH_SUGGESTIONS_FILE', ''),
+
+            # Rate limiting (token buckets refilled over RATE_LIMIT_WINDOW seconds)
+            'RATE_LIMIT_ENABLED': os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true',
+            'RATE_LIMIT_WINDOW': int(os.getenv('RATE_LIMIT_WINDOW', 60)),
+            'RATE_LIMIT_REQUESTS': int(os.getenv('RATE_LIMIT_REQUESTS', 30)),
+            'RATE_LIMIT_TOKENS': int(os.getenv('RATE_LIMIT_TOKENS', 20000)),
+            'RATE_LIMIT_REDIS_URL': os.getenv('RATE_LIMIT_REDIS_URL', ''),
+            # Comma-separated X-API-Key values that get their own quota (others are limited by IP)
+            'API_KEYS': [k.strip() for k in os.getenv('API_KEYS', '').split(',') if k.strip()]
+        }
+
+bp = Blueprint('chat', __name__)
 
 # HTML Template with enhanced features
 HTML_TEMPLATE = """
@@ -115,12 +193,18 @@ HTML_TEMPLATE = """
             flex: 1;
             overflow-y: auto;
             padding: 1rem;
-            scroll-behavior: smooth;
+            overflow-anchor: none;
+        }
+
+        .virtual-row {
+            padding-bottom: 1rem;
         }
 
         .message {
-            margin-bottom: 1rem;
             display: flex;
+        }
+
+        .message.fresh {
             animation: slideIn 0.3s ease-out;
         }
 
@@ -324,6 +408,64 @@ HTML_TEMPLATE = """
             color: #e2e8f0;
         }
 
+        .control-button.active {
+            background: rgba(79, 70, 229, 0.4);
+            color: #e2e8f0;
+        }
+
+        .compare-panel {
+            display: none;
+            flex-wrap: wrap;
+            gap: 0.5rem;
+            margin-bottom: 0.75rem;
+            font-size: 0.8rem;
+            color: #94a3b8;
+        }
+
+        .compare-panel.active {
+            display: flex;
+        }
+
+        .compare-panel label {
+            display: flex;
+            align-items: center;
+            gap: 0.25rem;
+            padding: 0.25rem 0.5rem;
+            border-radius: 0.5rem;
+            background: rgba(100, 116, 139, 0.2);
+            cursor: pointer;
+        }
+
+        .compare-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
+            gap: 0.75rem;
+            width: 100%;
+        }
+
+        .compare-column {
+            background: rgba(55, 65, 81, 0.9);
+            border: 1px solid rgba(100, 116, 139, 0.2);
+            border-radius: 1rem;
+            padding: 0.875rem 1.125rem;
+            line-height: 1.6;
+            word-wrap: break-word;
+            white-space: pre-wrap;
+        }
+
+        .compare-model {
+            font-size: 0.75rem;
+            font-weight: 600;
+            color: #a5b4fc;
+            margin-bottom: 0.5rem;
+        }
+
+        .compare-stats {
+            font-size: 0.75rem;
+            opacity: 0.7;
+            margin-top: 0.5rem;
+        }
+
         .error-toast {
             position: fixed;
             top: 1rem;
@@ -454,7 +596,7 @@ HTML_TEMPLATE = """
         </div>
 
         <div class="chat-messages" id="chatMessages">
-            <div class="welcome-message">
+            <div class="welcome-message" id="welcomeMessage">
                 <h2>Welcome to your Personal AI Assistant!</h2>
                 <p>Start a conversation by typing a message below. Your local Ollama model is ready to help you with any questions or tasks.</p>
                 <div class="connection-status" id="connectionStatus">
@@ -474,6 +616,7 @@ HTML_TEMPLATE = """
         </div>
 
         <div class="chat-input">
+            <div class="compare-panel" id="comparePanel"></div>
             <form class="input-container" id="messageForm">
                 <textarea 
                     class="input-field" 
@@ -483,6 +626,12 @@ HTML_TEMPLATE = """
                     required
                 ></textarea>
                 <div class="controls">
+                    <button type="button" class="control-button" id="compareButton" title="Compare models">
+                        <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                            <rect x="3" y="4" width="7" height="16" rx="1"/>
+                            <rect x="14" y="4" width="7" height="16" rx="1"/>
+                        </svg>
+                    </button>
                     <button type="button" class="control-button" id="clearButton" title="Clear chat">
                         <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
                             <path d="M3 6h18M19 6v14c0 1-1 2-2 2H7c-1 0-2-1-2-2V6M8 6V4c0-1 1-2 2-2h4c1 0 2 1 2 2v2"/>
@@ -505,13 +654,345 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
+        // Full transcript lives in IndexedDB; only the visible window is kept in memory
+        class TranscriptStore {
+            constructor(name) {
+                this.name = name;
+                this.db = null;
+                this.memory = new Map(); // Fallback when IndexedDB is unavailable
+                this.count = 0;
+            }
+
+            async open() {
+                if (!window.indexedDB) return;
+                try {
+                    this.db = await new Promise((resolve, reject) => {
+                        const request = indexedDB.open(this.name, 1);
+                        request.onupgradeneeded = () => request.result.createObjectStore('messages', { keyPath: 'index' });
+                        request.onsuccess = () => resolve(request.result);
+                        request.onerror = () => reject(request.error);
+                    });
+                    this.count = await this.request(this.objectStore('readonly').count());
+                } catch (error) {
+                    console.warn('IndexedDB unavailable, keeping transcript in memory:', error);
+                    this.db = null;
+                }
+            }
+
+            objectStore(mode) {
+                return this.db.transaction('messages', mode).objectStore('messages');
+            }
+
+            request(request) {
+                return new Promise((resolve, reject) => {
+                    request.onsuccess = () => resolve(request.result);
+                    request.onerror = () => reject(request.error);
+                });
+            }
+
+            put(record) {
+                if (!this.db) {
+                    this.memory.set(record.index, record);
+                    return Promise.resolve();
+                }
+                return this.request(this.objectStore('readwrite').put(record));
+            }
+
+            // Records with start <= index < end
+            async range(start, end) {
+                if (end <= start) return [];
+                if (!this.db) {
+                    const records = [];
+                    for (let i = start; i < end; i++) {
+                        if (this.memory.has(i)) records.push(this.memory.get(i));
+                    }
+                    return records;
+                }
+                return this.request(this.objectStore('readonly').getAll(IDBKeyRange.bound(start, end - 1)));
+            }
+
+            async clear() {
+                this.count = 0;
+                this.memory.clear();
+                if (this.db) await this.request(this.objectStore('readwrite').clear());
+            }
+        }
+
+        // Renders only the rows near the viewport. Heights are measured with a
+        // ResizeObserver (no forced layout) and DOM work is batched per animation frame.
+        class VirtualMessageList {
+            constructor(container, store, renderRecord, patchRecord = () => false) {
+                this.container = container;
+                this.store = store;
+                this.renderRecord = renderRecord;
+                this.patchRecord = patchRecord;
+
+                this.estimatedHeight = 96;
+                this.overscan = 6;
+                this.recordWindow = 200;
+
+                this.heights = [];
+                this.offsets = [0];
+                this.dirtyFrom = 0;
+                this.records = new Map();
+                this.pinned = new Set();
+                this.fresh = new Set();
+                this.elements = new Map();
+                this.pending = [];
+                this.loading = null;
+                this.frame = null;
+                this.stickToBottom = true;
+                this.userScrolled = false;
+                this.renderedTotal = 0;
+
+                this.topSpacer = document.createElement('div');
+                this.items = document.createElement('div');
+                this.bottomSpacer = document.createElement('div');
+                this.container.append(this.topSpacer, this.items, this.bottomSpacer);
+
+                this.resizeObserver = new ResizeObserver(entries => this.onResize(entries));
+                this.container.addEventListener('scroll', () => {
+                    this.userScrolled = true;
+                    this.schedule();
+                }, { passive: true });
+                window.addEventListener('resize', () => this.schedule());
+            }
+
+            get count() {
+                return this.store.count;
+            }
+
+            schedule() {
+                if (this.frame === null) {
+                    this.frame = requestAnimationFrame(() => this.render());
+                }
+            }
+
+            heightOf(index) {
+                return this.heights[index] ?? this.estimatedHeight;
+            }
+
+            offsetOf(index) {
+                if (this.dirtyFrom <= index) {
+                    for (let i = this.dirtyFrom; i < this.count; i++) {
+                        this.offsets[i + 1] = this.offsets[i] + this.heightOf(i);
+                    }
+                    this.offsets.length = this.count + 1;
+                    this.dirtyFrom = this.count;
+                }
+                return this.offsets[index];
+            }
+
+            // Index of the row containing vertical offset y
+            indexAt(y) {
+                this.offsetOf(this.count);
+                let low = 0;
+                let high = Math.max(0, this.count - 1);
+                while (low < high) {
+                    const mid = (low + high + 1) >> 1;
+                    if (this.offsets[mid] <= y) low = mid;
+                    else high = mid - 1;
+                }
+                return low;
+            }
+
+            append(record, { pinned = false } = {}) {
+                record.index = this.store.count++;
+                this.records.set(record.index, record);
+                this.fresh.add(record.index);
+                if (pinned) this.pinned.add(record.index);
+                else this.store.put(record);
+                this.stickToBottom = true;
+                this.schedule();
+                return record.index;
+            }
+
+            // Queue a change to a record; applied and painted once per frame
+            update(index, mutate) {
+                this.pending.push([index, mutate]);
+                this.schedule();
+            }
+
+            // Persist a pinned record once it has stopped changing
+            finish(index) {
+                this.update(index, record => {
+                    this.pinned.delete(index);
+                    this.store.put(record);
+                });
+            }
+
+            scrollToBottom() {
+                this.stickToBottom = true;
+                this.schedule();
+            }
+
+            async clear() {
+                this.elements.forEach(element => this.resizeObserver.unobserve(element));
+                this.items.replaceChildren();
+                this.elements.clear();
+                this.records.clear();
+                this.pinned.clear();
+                this.fresh.clear();
+                this.pending = [];
+                this.heights = [];
+                this.offsets = [0];
+                this.dirtyFrom = 0;
+                await this.store.clear();
+                this.schedule();
+            }
+
+            // Most recent records, e.g. for conversation context
+            async tail(limit) {
+                const start = Math.max(0, this.count - limit);
+                const stored = new Map();
+                for (const record of await this.store.range(start, this.count)) {
+                    stored.set(record.index, record);
+                }
+                // Order by record index; the store skips indices it has no record for
+                const records = [];
+                for (let i = start; i < this.count; i++) {
+                    const record = this.records.get(i) ?? stored.get(i);
+                    if (record) records.push(record);
+                }
+                return records;
+            }
+
+            onResize(entries) {
+                for (const entry of entries) {
+                    const index = Number(entry.target.dataset.index);
+                    const size = entry.borderBoxSize && entry.borderBoxSize[0];
+                    const height = size ? size.blockSize : entry.target.offsetHeight;
+                    if (height && height !== this.heights[index]) {
+                        this.heights[index] = height;
+                        this.dirtyFrom = Math.min(this.dirtyFrom, index);
+                    }
+                }
+                this.schedule();
+            }
+
+            flushPending() {
+                if (!this.pending.length) return;
+                const touched = new Set();
+                for (const [index, mutate] of this.pending) {
+                    const record = this.records.get(index);
+                    if (record) {
+                        mutate(record);
+                        touched.add(index);
+                    }
+                }
+                this.pending = [];
+                touched.forEach(index => {
+                    const element = this.elements.get(index);
+                    // Update the rendered row in place when possible; rebuild it otherwise
+                    if (element && !this.patchRecord(element, this.records.get(index))) {
+                        const replacement = this.createElement(this.records.get(index));
+                        element.replaceWith(replacement);
+                        this.resizeObserver.unobserve(element);
+                    }
+                });
+            }
+
+            createElement(record) {
+                const element = this.renderRecord(record, this.fresh.has(record.index));
+                this.fresh.delete(record.index);
+                element.dataset.index = record.index;
+                this.elements.set(record.index, element);
+                this.resizeObserver.observe(element);
+                return element;
+            }
+
+            async load(start, end) {
+                try {
+                    const records = await this.store.range(start, end);
+                    records.forEach(record => {
+                        if (!this.records.has(record.index)) this.records.set(record.index, record);
+                    });
+                } catch (error) {
+                    console.error('Failed to load messages:', error);
+                } finally {
+                    this.loading = null;
+                    this.schedule();
+                }
+            }
+
+            render() {
+                this.frame = null;
+                this.flushPending();
+
+                // Layout reads first, then writes only
+                const viewportHeight = this.container.clientHeight;
+                const scrollTop = this.container.scrollTop;
+                if (this.userScrolled) {
+                    this.stickToBottom = scrollTop + viewportHeight >= this.renderedTotal - 4;
+                    this.userScrolled = false;
+                }
+
+                const total = this.offsetOf(this.count);
+                const top = this.stickToBottom ? Math.max(0, total - viewportHeight) : scrollTop;
+                const start = this.count ? Math.max(0, this.indexAt(top) - this.overscan) : 0;
+                const end = this.count ? Math.min(this.count, this.indexAt(top + viewportHeight) + 1 + this.overscan) : 0;
+
+                let missingFrom = -1;
+                for (let i = start; i < end; i++) {
+                    if (!this.records.has(i)) {
+                        missingFrom = i;
+                        break;
+                    }
+                }
+                if (missingFrom !== -1 && !this.loading) {
+                    this.loading = this.load(missingFrom, end);
+                }
+
+                this.elements.forEach((element, index) => {
+                    if (index < start || index >= end) {
+                        this.resizeObserver.unobserve(element);
+                        element.remove();
+                        this.elements.delete(index);
+                    }
+                });
+
+                let previous = null;
+                for (let i = start; i < end; i++) {
+                    const record = this.records.get(i);
+                    if (!record) continue;
+                    const element = this.elements.get(i) || this.createElement(record);
+                    const expected = previous ? previous.nextSibling : this.items.firstChild;
+                    if (element !== expected) {
+                        this.items.insertBefore(element, expected);
+                    }
+                    previous = element;
+                }
+
+                this.topSpacer.style.height = `${this.offsetOf(start)}px`;
+                this.bottomSpacer.style.height = `${total - this.offsetOf(end)}px`;
+                this.renderedTotal = total;
+                if (this.stickToBottom) {
+                    this.container.scrollTop = total;
+                }
+
+                // Keep only a bounded window of records in memory
+                if (this.records.size > this.recordWindow) {
+                    const keepFrom = start - this.recordWindow / 2;
+                    const keepTo = end + this.recordWindow / 2;
+                    this.records.forEach((record, index) => {
+                        if ((index < keepFrom || index >= keepTo) && !this.pinned.has(index)) {
+                            this.records.delete(index);
+                        }
+                    });
+                }
+            }
+        }
+
         class ChatApp {
             constructor() {
                 this.chatMessages = document.getElementById('chatMessages');
+                this.welcomeMessage = document.getElementById('welcomeMessage');
                 this.messageInput = document.getElementById('messageInput');
                 this.messageForm = document.getElementById('messageForm');
                 this.sendButton = document.getElementById('sendButton');
                 this.clearButton = document.getElementById('clearButton');
+                this.compareButton = document.getElementById('compareButton');
+                this.comparePanel = document.getElementById('comparePanel');
                 this.typingIndicator = document.getElementById('typingIndicator');
                 this.errorToast = document.getElementById('errorToast');
                 this.statusDot = document.getElementById('statusDot');
@@ -520,16 +1001,41 @@ HTML_TEMPLATE = """
                 this.connectionMessage = document.getElementById('connectionMessage');
 
                 this.isWaitingForResponse = false;
-                this.messageHistory = [];
+                this.contextSize = 10; // Messages sent back to the model for context
+                this.statusInterval = {{ status_interval }} * 1000;
+                this.status = null;
+                this.serverLost = false;
+                this.context = [];
+                this.compareMode = false;
+                this.compareNodes = new WeakMap(); // Rendered compare row -> text nodes per model
+
+                this.messages = new VirtualMessageList(
+                    this.chatMessages,
+                    new TranscriptStore('chat-transcript'),
+                    (record, fresh) => this.renderRecord(record, fresh),
+                    (element, record) => this.patchRecord(element, record)
+                );
 
                 this.init();
             }
 
-            init() {
-                this.setupEventListeners();
+            async init() {
+                this.sendButton.disabled = true;
                 this.adjustTextareaHeight();
                 this.checkConnection();
                 this.messageInput.focus();
+
+                // Restore the previous session's transcript before anything can be
+                // appended, so new messages are numbered after the stored ones
+                await this.messages.store.open();
+                this.context = (await this.messages.tail(this.contextSize))
+                    .filter(record => record.role)
+                    .map(record => ({ role: record.role === 'ai' ? 'assistant' : 'user', content: record.content }));
+                this.updateWelcomeMessage();
+                this.messages.scrollToBottom();
+
+                this.setupEventListeners();
+                this.sendButton.disabled = false;
             }
 
             setupEventListeners() {
@@ -558,6 +1064,11 @@ HTML_TEMPLATE = """
                     this.clearChat();
                 });
 
+                // Model comparison toggle
+                this.compareButton.addEventListener('click', () => {
+                    this.toggleCompareMode();
+                });
+
                 // Auto-hide error toast
                 this.errorToast.addEventListener('click', () => {
                     this.hideError();
@@ -569,21 +1080,53 @@ HTML_TEMPLATE = """
                 this.messageInput.style.height = Math.min(this.messageInput.scrollHeight, 120) + 'px';
             }
 
-            async checkConnection() {
-                try {
-                    const response = await fetch('/api/health');
-                    const data = await response.json();
+            checkConnection() {
+                // Each response carries the status only if it changed since the last
+                // event id, then closes; the browser reconnects after the server's
+                // retry delay, so an open tab costs one empty response per interval
+                const source = new EventSource('/api/status/stream');
+                source.addEventListener('status', (e) => {
+                    this.status = JSON.parse(e.data);
+                    this.showStatus(this.status);
+                });
+                source.addEventListener('open', () => {
+                    this.statusSeenAt = Date.now();
+                    if (this.serverLost && this.status) {
+                        this.serverLost = false;
+                        this.showStatus(this.status);
+                    }
+                });
+                source.addEventListener('error', () => {
+                    if (source.readyState === EventSource.CLOSED) {
+                        source.close();
+                        this.markServerLost();
+                        setTimeout(() => this.checkConnection(), this.statusInterval);
+                    }
+                });
 
-                    if (data.ollama === 'connected') {
-                        this.updateConnectionStatus(true);
-                    } else {
-                        this.updateConnectionStatus(false);
+                // While the server is unreachable the browser keeps retrying without
+                // reporting it, so notice when reconnects stop succeeding
+                this.statusSeenAt = Date.now();
+                clearInterval(this.statusWatchdog);
+                this.statusWatchdog = setInterval(() => {
+                    if (Date.now() - this.statusSeenAt > 2 * this.statusInterval + 5000) {
+                        this.markServerLost();
                     }
-                } catch (error) {
-                    this.updateConnectionStatus(false);
+                }, this.statusInterval);
+            }
+
+            showStatus(data) {
+                this.updateConnectionStatus(data.ollama === 'connected');
+                if (data.ollama === 'connected' && !data.model_available) {
+                    this.connectionMessage.textContent = `⚠️ Connected to Ollama, but the ${data.model} model is not installed.`;
                 }
             }
 
+            markServerLost() {
+                this.serverLost = true;
+                this.updateConnectionStatus(false);
+            }
+
             updateConnectionStatus(connected) {
                 if (connected) {
                     this.statusDot.classList.remove('disconnected');
@@ -600,13 +1143,22 @@ HTML_TEMPLATE = """
                 }
             }
 
+            pushContext(role, content) {
+                this.context.push({ role, content });
+                if (this.context.length > this.contextSize) this.context.shift();
+            }
+
             async handleSendMessage() {
                 const message = this.messageInput.value.trim();
                 if (!message || this.isWaitingForResponse) return;
 
+                if (this.compareMode) {
+                    return this.handleCompareMessage(message);
+                }
+
                 // Add user message to chat
                 this.addMessage(message, 'user');
-                this.messageHistory.push({ role: 'user', content: message });
+                this.pushContext('user', message);
 
                 // Clear input and reset height
                 this.messageInput.value = '';
@@ -621,12 +1173,19 @@ HTML_TEMPLATE = """
                         headers: {
                             'Content-Type': 'application/json',
                         },
-                        body: JSON.stringify({ 
+                        body: JSON.stringify({
                             message: message,
-                            history: this.messageHistory.slice(-10) // Send last 10 messages for context
+                            history: this.context // Last messages for context
                         })
                     });
 
+                    if (response.status === 429 || response.status === 413) {
+                        const data = await response.json();
+                        this.hideTypingIndicator();
+                        this.showError(data.response);
+                        return;
+                    }
+
                     if (!response.ok) {
                         throw new Error(`HTTP ${response.status}: ${response.statusText}`);
                     }
@@ -638,7 +1197,7 @@ HTML_TEMPLATE = """
 
                     // Add AI response to chat
                     this.addMessage(data.response, 'ai');
-                    this.messageHistory.push({ role: 'assistant', content: data.response });
+                    this.pushContext('assistant', data.response);
 
                 } catch (error) {
                     console.error('Error:', error);
@@ -648,43 +1207,207 @@ HTML_TEMPLATE = """
                 }
             }
 
+            async toggleCompareMode() {
+                this.compareMode = !this.compareMode;
+                this.compareButton.classList.toggle('active', this.compareMode);
+                this.comparePanel.classList.toggle('active', this.compareMode);
+
+                if (this.compareMode && !this.comparePanel.children.length) {
+                    try {
+                        const response = await fetch('/api/models');
+                        const data = await response.json();
+                        const current = document.getElementById('modelBadge').textContent.trim();
+                        (data.models || []).forEach(model => {
+                            const label = document.createElement('label');
+                            const checkbox = document.createElement('input');
+                            checkbox.type = 'checkbox';
+                            checkbox.value = model.name;
+                            checkbox.checked = model.name === current;
+                            label.appendChild(checkbox);
+                            label.appendChild(document.createTextNode(model.name));
+                            this.comparePanel.appendChild(label);
+                        });
+                    } catch (error) {
+                        this.showError('Failed to load the list of models.');
+                    }
+                }
+            }
+
+            async handleCompareMessage(message) {
+                const models = Array.from(this.comparePanel.querySelectorAll('input:checked')).map(input => input.value);
+                if (!models.length) {
+                    this.showError('Select at least one model to compare.');
+                    return;
+                }
+
+                this.addMessage(message, 'user');
+                this.messageInput.value = '';
+                this.adjustTextareaHeight();
+                this.showTypingIndicator();
+
+                const index = this.addCompareMessage(models);
+
+                try {
+                    const response = await fetch('/api/chat/compare', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify({
+                            message: message,
+                            history: this.context.concat([{ role: 'user', content: message }]).slice(-this.contextSize),
+                            models: models
+                        })
+                    });
+
+                    if (!response.ok) {
+                        const data = await response.json();
+                        throw new Error(data.response || data.error || `HTTP ${response.status}`);
+                    }
+
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                            const raw = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            const event = (raw.match(/^event: (.*)$/m) || [])[1];
+                            const data = JSON.parse((raw.match(/^data: (.*)$/m) || [])[1] || '{}');
+
+                            this.messages.update(index, record => {
+                                const column = record.columns[data.model];
+                                if (!column) return;
+                                if (event === 'token') {
+                                    column.content += data.content;
+                                } else if (event === 'done') {
+                                    column.stats = `TTFT ${data.ttft}s · ${data.tokens_per_sec ?? '-'} tok/s · ${data.total_time}s total`;
+                                } else if (event === 'error') {
+                                    column.stats = `Error: ${data.error}`;
+                                }
+                            });
+                        }
+                    }
+                } catch (error) {
+                    console.error('Error:', error);
+                    this.showError(error.message || 'Failed to compare models.');
+                } finally {
+                    this.messages.finish(index);
+                    this.hideTypingIndicator();
+                }
+            }
+
+            addCompareMessage(models) {
+                const columns = {};
+                models.forEach(model => {
+                    columns[model] = { content: '', stats: 'Waiting for first token...' };
+                });
+                this.updateWelcomeMessage(true);
+                return this.messages.append({ type: 'compare', columns, time: this.timestamp() }, { pinned: true });
+            }
+
             addMessage(content, type) {
+                this.updateWelcomeMessage(true);
+                this.messages.append({ role: type, content, time: this.timestamp() });
+            }
+
+            timestamp() {
+                return new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+            }
+
+            renderRecord(record, fresh) {
+                const row = document.createElement('div');
+                row.className = 'virtual-row';
+
                 const messageElement = document.createElement('div');
-                messageElement.className = `message ${type}`;
+                messageElement.className = `message ${record.role || 'ai'}${fresh ? ' fresh' : ''}`;
+
+                if (record.type === 'compare') {
+                    const grid = document.createElement('div');
+                    grid.className = 'compare-grid';
+                    const nodes = {};
+
+                    Object.entries(record.columns).forEach(([model, column]) => {
+                        const columnElement = document.createElement('div');
+                        columnElement.className = 'compare-column';
+
+                        const name = document.createElement('div');
+                        name.className = 'compare-model';
+                        name.textContent = model;
 
-                const messageContent = document.createElement('div');
-                messageContent.className = 'message-content';
+                        const content = document.createElement('div');
+                        const contentText = document.createTextNode(column.content);
+                        content.appendChild(contentText);
 
-                // Add message text
-                const textElement = document.createElement('div');
-                textElement.textContent = content;
-                messageContent.appendChild(textElement);
+                        const stats = document.createElement('div');
+                        stats.className = 'compare-stats';
+                        const statsText = document.createTextNode(column.stats);
+                        stats.appendChild(statsText);
 
-                // Add timestamp
-                const timeElement = document.createElement('div');
-                timeElement.className = 'message-time';
-                timeElement.textContent = new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
-                messageContent.appendChild(timeElement);
+                        nodes[model] = { content: contentText, stats: statsText };
+                        columnElement.append(name, content, stats);
+                        grid.appendChild(columnElement);
+                    });
+
+                    messageElement.appendChild(grid);
+                    this.compareNodes.set(row, nodes);
+                } else {
+                    const messageContent = document.createElement('div');
+                    messageContent.className = 'message-content';
 
-                messageElement.appendChild(messageContent);
+                    // Add message text
+                    const textElement = document.createElement('div');
+                    textElement.textContent = record.content;
+                    messageContent.appendChild(textElement);
 
-                // Remove welcome message if present
-                const welcomeMessage = this.chatMessages.querySelector('.welcome-message');
-                if (welcomeMessage) {
-                    welcomeMessage.remove();
+                    // Add timestamp
+                    const timeElement = document.createElement('div');
+                    timeElement.className = 'message-time';
+                    timeElement.textContent = record.time;
+                    messageContent.appendChild(timeElement);
+
+                    messageElement.appendChild(messageContent);
                 }
 
-                this.chatMessages.appendChild(messageElement);
+                row.appendChild(messageElement);
+                return row;
+            }
+
+            // Apply streamed tokens to a rendered compare row without rebuilding it
+            patchRecord(element, record) {
+                const nodes = this.compareNodes.get(element);
+                if (!nodes || record.type !== 'compare') return false;
+                for (const [model, column] of Object.entries(record.columns)) {
+                    const node = nodes[model];
+                    if (!node) return false;
+                    // Column content only grows while streaming, so append the new text
+                    if (column.content.length > node.content.length) {
+                        node.content.appendData(column.content.slice(node.content.length));
+                    } else if (column.content.length < node.content.length) {
+                        node.content.data = column.content;
+                    }
+                    if (node.stats.data !== column.stats) {
+                        node.stats.data = column.stats;
+                    }
+                }
+                return true;
+            }
 
-                // Auto-scroll to bottom
-                this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+            updateWelcomeMessage(hasMessages = this.messages.count > 0) {
+                this.welcomeMessage.style.display = hasMessages ? 'none' : '';
             }
 
             showTypingIndicator() {
                 this.isWaitingForResponse = true;
                 this.sendButton.disabled = true;
                 this.typingIndicator.classList.add('active');
-                this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+                this.messages.scrollToBottom();
             }
 
             hideTypingIndicator() {
@@ -706,22 +1429,12 @@ HTML_TEMPLATE = """
                 this.errorToast.classList.remove('show');
             }
 
-            clearChat() {
-                const messages = this.chatMessages.querySelectorAll('.message');
-                messages.forEach(message => message.remove());
-                this.messageHistory = [];
+            async clearChat() {
+                await this.messages.clear();
+                this.context = [];
 
                 // Show welcome message again
-                const welcomeMessage = document.createElement('div');
-                welcomeMessage.className = 'welcome-message';
-                welcomeMessage.innerHTML = `
-                    <h2>Welcome to your Personal AI Assistant!</h2>
-                    <p>Start a conversation by typing a message below. Your local Ollama model is ready to help you with any questions or tasks.</p>
-                    <div class="connection-status connected" id="connectionStatus">
-                        <span id="connectionMessage">✅ Connected to Ollama - Ready to chat!</span>
-                    </div>
-                `;
-                this.chatMessages.appendChild(welcomeMessage);
+                this.updateWelcomeMessage(false);
 
                 this.messageInput.focus();
             }
@@ -736,29 +1449,124 @@ HTML_TEMPLATE = """
 </html>
 """
 
+_ollama_session = None
+_ollama_session_pid = None
+
+def get_ollama_session():
+    """Return this process's pooled HTTP session for Ollama.
+
+    Sessions are never shared across a fork: a worker that inherits the
+    parent's session gets a fresh one on first use.
+    """
+    global _ollama_session, _ollama_session_pid
+    if _ollama_session is None or _ollama_session_pid != os.getpid():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, current_app.config['THREADS']))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _ollama_session, _ollama_session_pid = session, os.getpid()
+    return _ollama_session
+
+def warm_ollama_client():
+    """Open a keep-alive connection to Ollama so the first chat skips the handshake."""
+    if check_ollama_connection():
+        logger.info(f"Ollama client warmed in process {os.getpid()}")
+    else:
+        logger.warning(f"Could not warm Ollama client in process {os.getpid()}")
+
 def check_ollama_connection():
     """Check if Ollama server is running and accessible."""
     try:
-        response = requests.get(f"{Config.OLLAMA_BASE_URL}/api/tags", timeout=5)
+        response = get_ollama_session().get(f"{current_app.config['OLLAMA_BASE_URL']}/api/tags", timeout=5)
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
 
+class StatusMonitor:
+    """Shares one cached Ollama status probe among every status request.
+
+    The status is probed at most once per ``interval`` seconds per process;
+    while one request refreshes it, concurrent requests get the previous
+    status instead of probing too. Each change bumps ``version``, which
+    /api/status/stream uses as its event id. No thread is held per client,
+    so cost is independent of how many tabs are open.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._status = None
+        self._version = 0
+        self._checked_at = 0
+        self._probing = False
+
+    def probe(self):
+        """Query Ollama once for connectivity and installed models."""
+        try:
+            response = get_ollama_session().get(f"{current_app.config['OLLAMA_BASE_URL']}/api/tags", timeout=5)
+            connected = response.status_code == 200
+            models = sorted(m['name'] for m in response.json().get('models', [])) if connected else []
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            connected, models = False, []
+
+        model = current_app.config['MODEL_NAME']
+        return {
+            'ollama': 'connected' if connected else 'disconnected',
+            'model': model,
+            'model_available': model in models or f"{model}:latest" in models,
+            'models': models
+        }
+
+    def snapshot(self):
+        """Return ``(status, version)``, probing only if the status is older than ``interval``."""
+        with self._cond:
+            stale = self._status is None or time.monotonic() - self._checked_at >= self.interval
+            refresh = stale and not self._probing
+            if refresh:
+                self._probing = True
+            elif self._status is None:
+                # First probe still running in another request
+                self._cond.wait_for(lambda: not self._probing)
+            if not refresh:
+                return self._status, self._version
+
+        status = None
+        try:
+            status = self.probe()
+        finally:
+            with self._cond:
+                self._probing = False
+                if status is not None:
+                    self._checked_at = time.monotonic()
+                    if status != self._status:
+                        self._status = status
+                        self._version += 1
+                self._cond.notify_all()
+        return status, self._version
+
+def build_messages(message, history=None):
+    """Build the conversation sent to Ollama."""
+    messages = []
+    if history:
+        messages.extend(history)
+    else:
+        messages.append({
+            "role": "user",
+            "content": message
+        })
+    return messages
+
 def get_ollama_response(message, history=None):
-    """Get response from Ollama API with conversation context."""
+    """Get response from Ollama API with conversation context.
+
+    Returns a ``(content, usage)`` tuple; ``content`` is None on failure and
+    ``usage`` is the OpenAI-style token usage reported by Ollama (may be empty).
+    """
     try:
-        # Build conversation history
-        messages = []
-        if history:
-            messages.extend(history)
-        else:
-            messages.append({
-                "role": "user",
-                "content": message
-            })
+        messages = build_messages(message, history)
 
         payload = {
-            "model": Config.MODEL_NAME,
+            "model": current_app.config['MODEL_NAME'],
             "messages": messages,
             "stream": False,
             "options": {
@@ -767,8 +1575,8 @@ def get_ollama_response(message, history=None):
             }
         }
 
-        response = requests.post(
-            f"{Config.OLLAMA_BASE_URL}/v1/chat/completions",
+        response = get_ollama_session().post(
+            f"{current_app.config['OLLAMA_BASE_URL']}/v1/chat/completions",
             json=payload,
             headers={"Content-Type": "application/json"},
             timeout=60
@@ -776,31 +1584,1401 @@ def get_ollama_response(message, history=None):
 
         if response.status_code == 200:
             data = response.json()
-            return data['choices'][0]['message']['content']
+            return data['choices'][0]['message']['content'], data.get('usage') or {}
         else:
             logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return None
+            return None, {}
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Request error: {str(e)}")
-        return None
+        return None, {}
     except KeyError as e:
         logger.error(f"Unexpected response format: {str(e)}")
-        return None
+        return None, {}
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        return None
+        return None, {}
+
+def ollama_chat_payload(messages, model, response_format=None, tools=None):
+    """Build a streaming request body for Ollama's native /api/chat."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "options": {
+            "temperature": 0.7,
+            "num_predict": 2000
+        }
+    }
+    if response_format:
+        payload["format"] = response_format
+    if tools:
+        payload["tools"] = tools
+    return payload
+
+def stream_ollama_chat(messages, model, timeout=60, response_format=None, tools=None):
+    """Stream a chat from Ollama's native API, yielding each decoded chunk.
+
+    The final chunk has ``done`` set and carries Ollama's timing counters
+    (``eval_count``, ``eval_duration``, ...). ``response_format`` and
+    ``tools`` are passed through as Ollama's ``format`` and ``tools``.
+    """
+    with get_ollama_session().post(
+        f"{current_app.config['OLLAMA_BASE_URL']}/api/chat",
+        json=ollama_chat_payload(messages, model, response_format, tools),
+        stream=True,
+        timeout=timeout
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Ollama API error: {response.status_code} - {response.text}")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if 'error' in chunk:
+                raise RuntimeError(chunk['error'])
+            yield chunk
+            if chunk.get('done'):
+                return
+
+class SchemaMismatch(ValueError):
+    """Raised when streamed output can no longer match the requested schema."""
+
+class LimitExceeded(SchemaMismatch):
+    """Raised when streamed JSON breaks a size limit (``maxLength``, ``maxItems``)."""
+
+class StreamingJSONValidator:
+    """Incrementally checks streamed text against a JSON schema.
+
+    Text is fed as it arrives and ``SchemaMismatch`` is raised at the first
+    character that makes a match impossible, so a bad generation can be
+    aborted early instead of parsed after the fact. Supported keywords:
+    ``type``, ``properties``, ``required``, ``additionalProperties``,
+    ``items``, ``enum``, ``minItems``, ``maxItems`` and ``maxLength``;
+    anything else is treated as unconstrained. Nesting deeper than
+    ``max_depth`` and documents with more than ``max_values`` values are
+    rejected.
+    """
+
+    NUMBER_CHARS = set('0123456789+-.eE')
+    LITERALS = {'t': ('true', 'boolean'), 'f': ('false', 'boolean'), 'n': ('null', 'null')}
+    NUMBER_PATTERN = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+    STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    HEX_DIGITS = set('0123456789abcdefABCDEF')
+
+    def __init__(self, schema=None, max_depth=64, max_values=None):
+        self.schema = schema if isinstance(schema, dict) else {}
+        self.max_depth = max_depth
+        self.max_values = max_values
+        self.values = 0
+        self.position = 0
+        self.done = False
+        self._stack = []
+        self._expect = 'value'
+        self._value_schema = self.schema
+        self._scalar = None
+        self._escape = False
+
+    def feed(self, text):
+        i, end = 0, len(text)
+        while i < end:
+            scalar = self._scalar
+            if (scalar is not None and scalar['kind'] == 'string' and scalar['chars'] is None
+                    and not self._escape and not scalar['hex']):
+                # Skip plain string content in one step when its text isn't needed
+                match = self.STRING_SPECIAL.search(text, i)
+                stop = match.start() if match else end
+                if stop > i:
+                    self.position += stop - i
+                    self._count_string_chars(scalar, stop - i)
+                    i = stop
+                    continue
+            self._feed_char(text[i])
+            self.position += 1
+            i += 1
+
+    def close(self):
+        """Check that the streamed text formed one complete, valid value."""
+        if self._scalar is not None and self._scalar['kind'] == 'number':
+            self._finish_number()
+        if not self.done:
+            self._fail("incomplete JSON")
+
+    def _fail(self, reason, error=SchemaMismatch):
+        raise error(f"{reason} at character {self.position}")
+
+    @staticmethod
+    def _types(schema):
+        types = schema.get('type')
+        if types is None:
+            return None
+        return {types} if isinstance(types, str) else set(types)
+
+    def _feed_char(self, char):
+        scalar = self._scalar
+        if scalar is not None:
+            if scalar['kind'] == 'string':
+                self._feed_string(char)
+                return
+            if scalar['kind'] == 'literal':
+                scalar['text'] += char
+                if not scalar['target'].startswith(scalar['text']):
+                    self._fail(f"invalid literal {scalar['text']!r}")
+                if scalar['text'] == scalar['target']:
+                    self._scalar = None
+                    self._check_enum(scalar['schema'], json.loads(scalar['text']))
+                    self._finish_value()
+                return
+            if char in self.NUMBER_CHARS:
+                scalar['chars'].append(char)
+                if char in '.eE' and self._types(scalar['schema']) == {'integer'}:
+                    self._fail("expected an integer")
+                return
+            self._finish_number()
+
+        if char.isspace():
+            return
+
+        expect = self._expect
+        if expect == 'value':
+            self._start_value(char)
+        elif expect == 'value_or_end':
+            if char == ']':
+                self._close_container('array')
+            else:
+                self._start_value(char)
+        elif expect in ('key_or_end', 'key'):
+            if char == '}' and expect == 'key_or_end':
+                self._close_container('object')
+            elif char == '"':
+                self._scalar = {'kind': 'string', 'chars': [], 'schema': None, 'key': True, 'length': 0, 'hex': 0, 'code': 0}
+            else:
+                self._fail("expected an object key")
+        elif expect == 'colon':
+            if char != ':':
+                self._fail("expected ':'")
+            frame = self._stack[-1]
+            properties = frame['schema'].get('properties', {})
+            additional = frame['schema'].get('additionalProperties')
+            self._value_schema = properties.get(frame['key'], additional if isinstance(additional, dict) else {})
+            self._expect = 'value'
+        elif expect == 'comma_or_end':
+            frame = self._stack[-1]
+            if char == ',':
+                if frame['kind'] == 'object':
+                    self._expect = 'key'
+                else:
+                    max_items = frame['schema'].get('maxItems')
+                    if max_items is not None and frame['count'] >= max_items:
+                        self._fail(f"more than {max_items} items", LimitExceeded)
+                    self._value_schema = frame['schema'].get('items', {})
+                    self._expect = 'value'
+            elif char == '}' and frame['kind'] == 'object':
+                self._close_container('object')
+            elif char == ']' and frame['kind'] == 'array':
+                self._close_container('array')
+            else:
+                self._fail("expected ',' or end of container")
+        else:
+            self._fail("unexpected content after the JSON value")
+
+    def _start_value(self, char):
+        schema = self._value_schema
+        types = self._types(schema)
+
+        self.values += 1
+        if self.max_values is not None and self.values > self.max_values:
+            self._fail(f"more than {self.max_values} values", LimitExceeded)
+
+        if char == '{':
+            kind = 'object'
+        elif char == '[':
+            kind = 'array'
+        elif char == '"':
+            kind = 'string'
+        elif char == '-' or char.isdigit():
+            kind = 'number'
+        elif char in self.LITERALS:
+            kind = self.LITERALS[char][1]
+        else:
+            self._fail(f"unexpected character {char!r}")
+
+        allowed = types is None or kind in types or (kind == 'number' and 'integer' in types)
+        if not allowed:
+            self._fail(f"expected {'/'.join(sorted(types))}, got {kind}")
+
+        if kind in ('object', 'array'):
+            if len(self._stack) >= self.max_depth:
+                self._fail(f"nesting deeper than {self.max_depth} levels", LimitExceeded)
+            self._stack.append({'kind': kind, 'schema': schema, 'key': None, 'keys': set(), 'count': 0})
+            if kind == 'object':
+                self._expect = 'key_or_end'
+            else:
+                self._value_schema = schema.get('items', {})
+                self._expect = 'value_or_end'
+        elif kind == 'string':
+            # Only keep the text when it has to be compared against something
+            chars = [] if 'enum' in schema else None
+            self._scalar = {'kind': 'string', 'chars': chars, 'schema': schema, 'key': False, 'length': 0, 'hex': 0, 'code': 0}
+        elif kind == 'number':
+            self._scalar = {'kind': 'number', 'chars': [char], 'schema': schema}
+        else:
+            self._scalar = {'kind': 'literal', 'text': char, 'target': self.LITERALS[char][0], 'schema': schema}
+
+    def _feed_string(self, char):
+        scalar = self._scalar
+        if self._escape:
+            self._escape = False
+            if char == 'u':
+                # \uXXXX is one character spread over four more hex digits
+                scalar['hex'], scalar['code'] = 4, 0
+            elif char in self.ESCAPES:
+                self._append_string_char(scalar, self.ESCAPES[char])
+            else:
+                self._fail(f"invalid escape character {char!r}")
+            self._count_string_chars(scalar)
+            return
+        if scalar['hex']:
+            if char not in self.HEX_DIGITS:
+                self._fail("invalid \\u escape")
+            scalar['hex'] -= 1
+            scalar['code'] = scalar['code'] * 16 + int(char, 16)
+            if not scalar['hex']:
+                self._append_string_char(scalar, chr(scalar['code']))
+            return
+        if char == '\\':
+            self._escape = True
+            return
+        if char < ' ':
+            self._fail("unescaped control character in string")
+        if char != '"':
+            self._append_string_char(scalar, char)
+            self._count_string_chars(scalar)
+            return
+
+        self._scalar = None
+        if scalar['chars'] is None:
+            self._finish_value()
+            return
+
+        value = ''.join(scalar['chars'])
+        if not scalar['key']:
+            self._check_enum(scalar['schema'], value)
+            self._finish_value()
+            return
+
+        frame = self._stack[-1]
+        if frame['schema'].get('additionalProperties') is False and value not in frame['schema'].get('properties', {}):
+            self._fail(f"unexpected property {value!r}")
+        frame['key'] = value
+        frame['keys'].add(value)
+        self._expect = 'colon'
+
+    def _append_string_char(self, scalar, char):
+        """Add one decoded character to a string whose text is kept."""
+        chars = scalar['chars']
+        if chars is None:
+            return
+        if chars and '\udc00' <= char <= '\udfff' and '\ud800' <= chars[-1] <= '\udbff':
+            # Join an escaped UTF-16 surrogate pair into one character
+            chars[-1] = chr(0x10000 + ((ord(chars[-1]) - 0xd800) << 10) + (ord(char) - 0xdc00))
+        else:
+            chars.append(char)
+        self._check_string_prefix(scalar)
+
+    def _count_string_chars(self, scalar, count=1):
+        scalar['length'] += count
+        max_length = (scalar['schema'] or {}).get('maxLength')
+        if max_length is not None and scalar['length'] > max_length:
+            self._fail(f"string longer than {max_length} characters", LimitExceeded)
+
+    def _check_string_prefix(self, scalar):
+        """Fail as soon as a partial string cannot become an allowed value."""
+        if scalar['key']:
+            schema = self._stack[-1]['schema']
+            if schema.get('additionalProperties') is not False:
+                return
+            candidates = schema.get('properties', {})
+        else:
+            candidates = [v for v in scalar['schema'].get('enum', ()) if isinstance(v, str)]
+            if not candidates:
+                return
+        text = ''.join(scalar['chars'])
+        if '\ud800' <= text[-1] <= '\udbff':
+            # Wait for the second half of a surrogate pair
+            return
+        if not any(c.startswith(text) for c in candidates):
+            self._fail(f"unexpected string {text!r}")
+
+    def _finish_number(self):
+        scalar = self._scalar
+        self._scalar = None
+        text = ''.join(scalar['chars'])
+        if not self.NUMBER_PATTERN.match(text):
+            self._fail(f"invalid number {text!r}")
+        self._check_enum(scalar['schema'], json.loads(text))
+        self._finish_value()
+
+    def _check_enum(self, schema, value):
+        if 'enum' in schema and value not in schema['enum']:
+            self._fail(f"{value!r} is not one of {schema['enum']!r}")
+
+    def _close_container(self, kind):
+        frame = self._stack.pop()
+        schema = frame['schema']
+        if kind == 'object':
+            missing = [key for key in schema.get('required', []) if key not in frame['keys']]
+            if missing:
+                self._fail(f"missing required properties {missing!r}")
+        else:
+            min_items = schema.get('minItems')
+            if min_items is not None and frame['count'] < min_items:
+                self._fail(f"fewer than {min_items} items")
+        self._finish_value()
+
+    def _finish_value(self):
+        if not self._stack:
+            self._expect = 'end'
+            self.done = True
+            return
+        frame = self._stack[-1]
+        frame['count'] += 1
+        self._expect = 'comma_or_end'
+
+def get_structured_response(messages, response_format=None, tools=None, model=None):
+    """Generate output constrained to JSON (``response_format``) or tool calls.
+
+    ``response_format`` is ``"json"`` or a JSON schema and is passed to Ollama
+    as ``format``; the stream is validated as it arrives and a generation that
+    diverges from the schema is aborted and retried, up to
+    ``STRUCTURED_MAX_RETRIES`` times. Tool-call arguments are checked
+    against each tool's ``parameters`` schema the same way.
+
+    Returns ``(result, usage)``; ``result`` holds ``content`` plus ``data``
+    (the parsed object) or ``tool_calls``, and is None when every attempt
+    was rejected. Ollama failures (``requests.RequestException`` or
+    ``RuntimeError``) are raised to the caller.
+    """
+    schema = response_format if isinstance(response_format, dict) else {}
+    tool_schemas = {
+        tool.get('function', {}).get('name'): tool.get('function', {}).get('parameters') or {}
+        for tool in tools or []
+    }
+    generated = 0
+
+    for attempt in range(current_app.config['STRUCTURED_MAX_RETRIES'] + 1):
+        validator = StreamingJSONValidator(schema) if response_format else None
+        parts = []
+        tool_calls = []
+        counted = False
+        try:
+            with closing(stream_ollama_chat(messages, model or current_app.config['MODEL_NAME'],
+                                            response_format=response_format, tools=tools)) as chunks:
+                for chunk in chunks:
+                    message = chunk.get('message', {})
+                    content = message.get('content') or ''
+                    parts.append(content)
+                    if validator and content:
+                        validator.feed(content)
+                    tool_calls.extend(message.get('tool_calls') or [])
+                    if chunk.get('done'):
+                        generated += chunk.get('eval_count') or estimate_tokens(''.join(parts))
+                        counted = True
+
+            result = {'content': ''.join(parts)}
+            if validator:
+                validator.close()
+                try:
+                    result['data'] = json.loads(result['content'])
+                except ValueError as e:
+                    raise SchemaMismatch(f"invalid JSON: {str(e)}")
+            if tools:
+                for call in tool_calls:
+                    function = call.get('function', {})
+                    if function.get('name') not in tool_schemas:
+                        raise SchemaMismatch(f"unknown tool {function.get('name')!r}")
+                    arguments = StreamingJSONValidator(tool_schemas[function['name']])
+                    arguments.feed(json.dumps(function.get('arguments', {})))
+                    arguments.close()
+                result['tool_calls'] = tool_calls
+            return result, {'completion_tokens': generated}
+
+        except SchemaMismatch as e:
+            logger.warning(f"Structured output attempt {attempt + 1} rejected: {str(e)}")
+            if not counted:
+                generated += estimate_tokens(''.join(parts))
+
+    return None, {'completion_tokens': generated}
+
+def sse_event(event, data, event_id=None):
+    """Format one server-sent event."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def compare_model(model, messages, events, cancelled):
+    """Stream one model's answer into ``events`` and report its timings."""
+    started = time.perf_counter()
+    first_token_at = None
+    tokens = 0
+    final = {}
+
+    try:
+        for chunk in stream_ollama_chat(messages, model):
+            if cancelled.is_set():
+                return
+            content = chunk.get('message', {}).get('content')
+            if content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                tokens += 1
+                events.put(('token', {'model': model, 'content': content}))
+            if chunk.get('done'):
+                final = chunk
+    except Exception as e:
+        logger.error(f"Compare error for model {model}: {str(e)}")
+        events.put(('error', {'model': model, 'error': str(e)}))
+        return
+
+    total_time = time.perf_counter() - started
+    tokens = final.get('eval_count') or tokens
+    if final.get('eval_duration'):
+        generation_time = final['eval_duration'] / 1e9
+    else:
+        generation_time = total_time - ((first_token_at or started) - started)
+
+    events.put(('done', {
+        'model': model,
+        'tokens': tokens,
+        'ttft': round((first_token_at or time.perf_counter()) - started, 3),
+        'tokens_per_sec': round(tokens / generation_time, 2) if generation_time > 0 else None,
+        'total_time': round(total_time, 3)
+    }))
+
+def normalize_prompt(text):
+    """Normalize a user prompt for matching (case and whitespace insensitive)."""
+    return ' '.join((text or '').lower().split())
+
+class ResponseCache:
+    """Thread-safe LRU cache of generated responses with a time-to-live.
+
+    Entries are keyed on the model and the tail of the conversation (the
+    previous answer and the new prompt), which is what a follow-up depends on
+    and stays stable however much earlier history the client sends.
+    """
+
+    CONTEXT_MESSAGES = 3
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def key(cls, model, messages):
+        tail = [
+            [m.get('role'), normalize_prompt(m.get('content')) if m.get('role') == 'user' else (m.get('content') or '').strip()]
+            for m in messages[-cls.CONTEXT_MESSAGES:]
+        ]
+        return hashlib.sha256(json.dumps([model, tail]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+class PrefetchEngine:
+    """Speculatively answers the most likely follow-up questions while idle.
+
+    Follow-ups are predicted from configured suggestions (a JSON file mapping
+    a prompt, or ``"*"`` for any prompt, to a list of follow-ups) and from
+    prompt-to-prompt transitions observed in live traffic. Prefetches run one
+    at a time on a background thread and only while no foreground request is
+    in flight; a foreground request arriving mid-generation (including while
+    Ollama is still reading the prompt) aborts the prefetch, which is retried
+    once the backend is idle again.
+
+    The busy count and the cache live in this process only, so prefetching is
+    turned off when serving with several worker processes (see ``serve``).
+    """
+
+    MAX_TRANSITIONS = 10000
+    MAX_FOLLOW_UPS = 32
+    MAX_PENDING = 32
+
+    def __init__(self, app, cache, enabled=False, top_k=2, suggestions=None):
+        self.app = app
+        self.cache = cache
+        self.enabled = enabled
+        self.top_k = top_k
+        self.suggestions = {normalize_prompt(k) if k != '*' else k: v for k, v in (suggestions or {}).items()}
+        self._transitions = {}
+        self._jobs = deque(maxlen=self.MAX_PENDING)
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._thread_pid = None
+        self._connection = None
+        self._aborted = False
+
+    @contextmanager
+    def foreground(self):
+        """Mark a real request as in flight so prefetching yields to it."""
+        with self._cond:
+            self._inflight += 1
+            if self._connection is not None:
+                self._abort()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+
+    def observe(self, messages):
+        """Learn which prompt followed which from a conversation."""
+        if not self.enabled:
+            return
+        prompts = [normalize_prompt(m.get('content')) for m in messages if m.get('role') == 'user']
+        if len(prompts) < 2 or not prompts[-1]:
+            return
+        with self._cond:
+            counts = self._transitions.get(prompts[-2])
+            if counts is None:
+                if len(self._transitions) >= self.MAX_TRANSITIONS:
+                    self._transitions.pop(next(iter(self._transitions)))
+                counts = self._transitions[prompts[-2]] = Counter()
+            counts[prompts[-1]] += 1
+            if len(counts) > self.MAX_FOLLOW_UPS:
+                # Keep the most frequent half so new follow-ups can still get in
+                self._transitions[prompts[-2]] = Counter(dict(counts.most_common(self.MAX_FOLLOW_UPS // 2)))
+
+    def predict(self, prompt):
+        """Return up to ``top_k`` likely follow-ups to ``prompt``."""
+        prompt = normalize_prompt(prompt)
+        candidates = list(self.suggestions.get(prompt, []))
+        with self._cond:
+            counts = self._transitions.get(prompt)
+            if counts:
+                candidates.extend(p for p, _ in counts.most_common(self.top_k))
+        candidates.extend(self.suggestions.get('*', []))
+
+        follow_ups = {}
+        for candidate in candidates:
+            if candidate:
+                follow_ups.setdefault(normalize_prompt(candidate), candidate)
+        return list(follow_ups.values())[:self.top_k]
+
+    def schedule(self, messages, response, model):
+        """Queue prefetches for the follow-ups to an answered conversation."""
+        if not self.enabled:
+            return
+        prompt = next((m.get('content') for m in reversed(messages) if m.get('role') == 'user'), '')
+        conversation = messages + [{'role': 'assistant', 'content': response}]
+        with self._cond:
+            for follow_up in self.predict(prompt):
+                candidate = conversation + [{'role': 'user', 'content': follow_up}]
+                if ResponseCache.key(model, candidate) not in self.cache:
+                    self._jobs.append((candidate, model))
+            self._cond.notify_all()
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(); start one per worker process on demand
+        with self._cond:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='prefetch', daemon=True).start()
+
+    def _next_job(self):
+        with self._cond:
+            while not self._jobs or self._inflight:
+                self._cond.wait()
+            return self._jobs.popleft()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                self._prefetch_next()
+
+    def _prefetch_next(self):
+        messages, model = self._next_job()
+        key = ResponseCache.key(model, messages)
+        if key in self.cache:
+            return
+        try:
+            content = self._generate(messages, model)
+        except Exception as e:
+            logger.warning(f"Prefetch failed: {str(e)}")
+            return
+        if content is None:
+            # Preempted by foreground traffic; retry when idle
+            with self._cond:
+                self._jobs.appendleft((messages, model))
+            return
+        self.cache.put(key, content)
+        logger.info(f"Prefetched follow-up: {messages[-1]['content'][:60]}")
+
+    def _abort(self):
+        # Shutting the socket down wakes the prefetch thread even while it is
+        # still waiting for Ollama to read the prompt, and the dropped
+        # connection makes Ollama cancel the generation
+        self._aborted = True
+        if self._connection.sock is not None:
+            try:
+                self._connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _generate(self, messages, model):
+        # A connection of its own rather than the pooled session, so that
+        # foreground() can cut it off before Ollama has sent any headers
+        base = urlparse(current_app.config['OLLAMA_BASE_URL'])
+        connection_cls = http.client.HTTPSConnection if base.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_cls(base.hostname, base.port, timeout=60)
+        with self._cond:
+            self._connection = connection
+            self._aborted = False
+        parts = []
+        try:
+            connection.connect()
+            if self._aborted or self._inflight:
+                return None
+            connection.request('POST', base.path.rstrip('/') + '/api/chat',
+                               body=json.dumps(ollama_chat_payload(messages, model)),
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"Ollama API error: {response.status} - {response.read().decode('utf-8', 'replace')}")
+            for line in response:
+                if self._inflight:
+                    return None
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                parts.append(chunk.get('message', {}).get('content') or '')
+                if chunk.get('done'):
+                    return ''.join(parts)
+        except (OSError, http.client.HTTPException):
+            if not self._aborted:
+                raise
+        finally:
+            with self._cond:
+                self._connection = None
+            connection.close()
+        if self._aborted:
+            # Preempted by foreground traffic
+            return None
+        raise RuntimeError("Ollama closed the stream before the answer was complete")
+
+def load_prefetch_suggestions(path):
+    """Load configured follow-up suggestions from a JSON file."""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load prefetch suggestions from {path}: {str(e)}")
+        return {}
+
+class JobQueue:
+    """Durable queue for long generations, stored in SQLite.
+
+    Jobs are claimed by worker threads with a lease that is renewed while
+    output streams in, so a job whose worker died (or whose server was
+    restarted) is picked up again once the lease expires; its output then
+    restarts from offset 0 with a new ``attempt`` number. Output is stored as
+    numbered chunks so clients can resume a stream from any token offset.
+    Several processes can share the same database file.
+    """
+
+    POLL_INTERVAL = 1.0
+    FLUSH_INTERVAL = 0.25
+    STREAM_RETRY_MS = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            model TEXT NOT NULL,
+            messages TEXT NOT NULL,
+            client TEXT,
+            callback_url TEXT,
+            response TEXT,
+            error TEXT,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            attempt INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            lease_expires REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+        CREATE TABLE IF NOT EXISTS job_chunks (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        );
+    """
+
+    FINISHED = ('completed', 'failed', 'cancelled')
+
+    def __init__(self, app, path, workers, lease, retention, rate_limiter=None):
+        self.app = app
+        self.path = path
+        self.workers = workers
+        self.lease = lease
+        self.retention = retention
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._db().executescript(self.SCHEMA)
+
+    def _db(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def start(self):
+        """Start this process's worker threads (idempotent)."""
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, messages, model, client=None, callback_url=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db().execute(
+            "INSERT INTO jobs (id, status, model, messages, client, callback_url, created_at, updated_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, model, json.dumps(messages), client, callback_url, now, now)
+        )
+        return job_id
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            'id': row['id'],
+            'status': row['status'],
+            'model': row['model'],
+            'tokens': row['tokens'],
+            'attempt': row['attempt'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+        if row['status'] == 'completed':
+            job['response'] = row['response']
+        if row['error']:
+            job['error'] = row['error']
+        return job
+
+    def chunks(self, job_id, offset):
+        """Return stored output chunks from token ``offset`` onwards."""
+        rows = self._db().execute(
+            "SELECT seq, content FROM job_chunks WHERE job_id = ? AND seq >= ? ORDER BY seq",
+            (job_id, offset)
+        ).fetchall()
+        return [(row['seq'], row['content']) for row in rows]
+
+    def cancel(self, job_id):
+        cursor = self._db().execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id)
+        )
+        return cursor.rowcount > 0
+
+    def claim(self):
+        """Take the oldest queued job, or a running one whose lease expired."""
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            if row['status'] == 'running':
+                logger.warning(f"Reclaiming job {row['id']} after its lease expired")
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempt = attempt + 1, tokens = 0, "
+                "lease_expires = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease, now, row['id'])
+            )
+            db.execute("DELETE FROM job_chunks WHERE job_id = ?", (row['id'],))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        job = dict(row)
+        job['attempt'] += 1
+        return job
+
+    def _run(self):
+        with self.app.app_context():
+            self._work()
+
+    def _work(self):
+        last_cleanup = 0
+        while True:
+            try:
+                if time.monotonic() - last_cleanup > 3600:
+                    self.cleanup()
+                    last_cleanup = time.monotonic()
+                job = self.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Job queue error: {str(e)}")
+                job = None
+            if job is None:
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        db = self._db()
+        messages = json.loads(job['messages'])
+        seq = 0
+        pending = []
+        parts = []
+        last_flush = time.monotonic()
+
+        def flush():
+            # Store new chunks and renew the lease; False if the job was
+            # cancelled or reclaimed by another worker meanwhile
+            nonlocal pending, last_flush
+            now = time.time()
+            db.execute('BEGIN IMMEDIATE')
+            cursor = db.execute(
+                "UPDATE jobs SET tokens = ?, lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND attempt = ? AND status = 'running'",
+                (seq, now + self.lease, now, job['id'], job['attempt'])
+            )
+            if cursor.rowcount:
+                db.executemany("INSERT INTO job_chunks (job_id, seq, content) VALUES (?, ?, ?)",
+                               [(job['id'], s, c) for s, c in pending])
+            db.execute('COMMIT')
+            pending = []
+            last_flush = time.monotonic()
+            return cursor.rowcount > 0
+
+        prefetcher = current_app.extensions['prefetcher']
+        try:
+            with prefetcher.foreground(), closing(stream_ollama_chat(messages, job['model'])) as chunks:
+                for chunk in chunks:
+                    content = chunk.get('message', {}).get('content')
+                    if content:
+                        pending.append((seq, content))
+                        parts.append(content)
+                        seq += 1
+                    if time.monotonic() - last_flush >= self.FLUSH_INTERVAL and not flush():
+                        logger.info(f"Job {job['id']} stopped: cancelled or reclaimed")
+                        return
+            if not flush():
+                return
+            self._finish(job, 'completed', response=''.join(parts), tokens=seq)
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {str(e)}")
+            self._finish(job, 'failed', error=str(e), tokens=seq)
+
+    def _finish(self, job, status, response=None, error=None, tokens=0):
+        cursor = self._db().execute(
+            "UPDATE jobs SET status = ?, response = ?, error = ?, tokens = ?, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND attempt = ? AND status = 'running'",
+            (status, response, error, tokens, time.time(), job['id'], job['attempt'])
+        )
+        if not cursor.rowcount:
+            return
+
+        if self.rate_limiter is not None and job['client'] and tokens:
+            self.rate_limiter.consume(job['client'], 'tokens', amount=tokens, require=0)
+
+        if job['callback_url']:
+            try:
+                get_ollama_session().post(job['callback_url'], json=self.get(job['id']), timeout=10)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Callback for job {job['id']} failed: {str(e)}")
+
+    def cleanup(self):
+        """Delete finished jobs older than the retention period."""
+        cutoff = time.time() - self.retention
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(
+            "DELETE FROM job_chunks WHERE job_id IN "
+            "(SELECT id FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND updated_at < ?)",
+            (cutoff,)
+        )
+        db.execute("DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND updated_at < ?", (cutoff,))
+        db.execute('COMMIT')
+
+def is_local_callback(url):
+    """Only allow job callbacks to the configured (local) hosts."""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    return parsed.scheme in ('http', 'https') and parsed.hostname in current_app.config['JOBS_CALLBACK_HOSTS']
+
+def chat_request_schema():
+    """Limits enforced while a chat request body is parsed."""
+    content = {'type': 'string', 'maxLength': current_app.config['MAX_MESSAGE_CHARS']}
+    return {
+        'type': 'object',
+        'properties': {
+            'message': content,
+            'history': {
+                'type': 'array',
+                'maxItems': current_app.config['MAX_HISTORY_MESSAGES'],
+                'items': {'type': 'object', 'properties': {'role': {'type': 'string'}, 'content': content}}
+            }
+        }
+    }
+
+def job_request_schema():
+    """Limits enforced while a job submission body is parsed."""
+    schema = chat_request_schema()
+    schema['properties']['model'] = {'type': 'string', 'maxLength': 200}
+    schema['properties']['callback_url'] = {'type': 'string', 'maxLength': 2048}
+    return schema
+
+def read_json_body(schema):
+    """Parse the request's JSON body while it streams in.
+
+    The body is read in chunks and checked against ``schema`` as it arrives,
+    so a request that breaks a limit is rejected with 413 without reading or
+    buffering the rest. Bodies over ``MAX_CONTENT_LENGTH`` are refused before
+    any of it is read; malformed JSON is a 400.
+    """
+    validator = StreamingJSONValidator(schema, max_values=current_app.config['MAX_JSON_VALUES'])
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    try:
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            text = decoder.decode(chunk)
+            validator.feed(text)
+            parts.append(text)
+        validator.feed(decoder.decode(b'', final=True))
+        validator.close()
+    except LimitExceeded as e:
+        raise RequestEntityTooLarge(f"Request exceeds limits: {str(e)}")
+    except (SchemaMismatch, UnicodeDecodeError) as e:
+        raise BadRequest(f"Invalid JSON body: {str(e)}")
+    try:
+        g.json_body = json.loads(''.join(parts))
+    except ValueError as e:
+        raise BadRequest(f"Invalid JSON body: {str(e)}")
+    return g.json_body
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) when Ollama reports no usage."""
+    return max(1, math.ceil(len(text or '') / 4))
+
+class TokenBucket:
+    """A single token bucket; callers must hold the owning stripe lock."""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity, now):
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def refill(self, capacity, rate, now):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+class RateLimiter:
+    """In-process token-bucket rate limiter keyed by (client, kind).
+
+    Buckets are spread over a fixed set of stripes, each with its own lock, so
+    concurrent clients rarely contend. Each kind ('requests', 'tokens') has its
+    own capacity that refills linearly over ``window`` seconds. A stripe keeps
+    its buckets in least-recently-used order and drops the oldest once it
+    holds ``MAX_BUCKETS / STRIPES`` of them.
+    """
+
+    STRIPES = 64
+    MAX_BUCKETS = 100000
+
+    def __init__(self, limits, window):
+        self.limits = limits
+        self.window = float(window)
+        self._stripe_size = max(1, self.MAX_BUCKETS // self.STRIPES)
+        self._buckets = [OrderedDict() for _ in range(self.STRIPES)]
+        self._locks = [threading.Lock() for _ in range(self.STRIPES)]
+
+    def _stripe_for(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.STRIPES
+
+    def _rate(self, kind):
+        return self.limits[kind] / self.window
+
+    def consume(self, client, kind, amount=1, require=None):
+        """Take ``amount`` from a bucket.
+
+        The call is allowed when at least ``require`` (defaults to ``amount``)
+        tokens are available. ``amount`` may exceed what is left, letting
+        post-hoc charges (generated tokens) push the bucket into debt.
+        Returns ``(allowed, remaining, reset_seconds)``.
+        """
+        return self._consume_local(client, kind, amount, require)
+
+    def admit(self, client):
+        """Take one request from ``client``'s quota if it has generated tokens left.
+
+        Returns ``(allowed, remaining, reset_seconds)`` for the request bucket;
+        when the token quota is what blocks the call, ``reset_seconds`` is the
+        time until it has room again.
+        """
+        has_tokens, _, token_reset = self._consume_local(client, 'tokens', amount=0, require=1)
+        if not has_tokens:
+            remaining, reset = self.peek(client, 'requests')
+            return False, remaining, token_reset
+        return self._consume_local(client, 'requests')
+
+    def _consume_local(self, client, kind, amount=1, require=None):
+        capacity = self.limits[kind]
+        rate = self._rate(kind)
+        require = amount if require is None else require
+        key = f"{kind}:{client}"
+        now = time.monotonic()
+
+        stripe = self._stripe_for(key)
+        buckets = self._buckets[stripe]
+        with self._locks[stripe]:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self._stripe_size:
+                    buckets.popitem(last=False)
+                bucket = buckets[key] = TokenBucket(capacity, now)
+            else:
+                buckets.move_to_end(key)
+            bucket.refill(capacity, rate, now)
+            allowed = bucket.tokens >= require
+            if allowed:
+                bucket.tokens -= amount
+            tokens = bucket.tokens
+
+        return allowed, max(0, int(tokens)), self._reset_after(tokens, require, capacity, rate)
+
+    def peek(self, client, kind):
+        """Return this process's ``(remaining, reset_seconds)`` without consuming anything."""
+        allowed, remaining, reset = self._consume_local(client, kind, amount=0, require=0)
+        return remaining, reset
+
+    def _reset_after(self, tokens, require, capacity, rate):
+        if tokens >= require:
+            return math.ceil((capacity - tokens) / rate) if tokens < capacity else 0
+        return math.ceil((require - tokens) / rate)
+
+class RedisRateLimiter(RateLimiter):
+    """Token-bucket limiter shared by all worker processes through Redis.
+
+    The local in-memory buckets act as a fast path: this process's usage is a
+    lower bound on the shared usage, so an empty local bucket rejects without
+    a network round-trip. Otherwise the shared bucket is authoritative; the
+    admission check for a request is a single script call covering both of
+    the client's buckets. If Redis is unreachable the limiter degrades to
+    local-only limits.
+    """
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local require = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= require then
+    tokens = tokens - amount
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    ADMIT_SCRIPT = """
+local function refill(key, capacity, rate, now)
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    return math.min(capacity, tokens + math.max(0, now - updated) * rate)
+end
+local request_capacity = tonumber(ARGV[1])
+local request_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[5])
+local requests = refill(KEYS[1], request_capacity, request_rate, now)
+local tokens = refill(KEYS[2], tonumber(ARGV[3]), tonumber(ARGV[4]), now)
+local allowed = 0
+if requests >= 1 and tokens >= 1 then
+    requests = requests - 1
+    allowed = 1
+    redis.call('HSET', KEYS[1], 'tokens', tostring(requests), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(request_capacity / request_rate) + 1)
+end
+return {allowed, tostring(requests), tostring(tokens)}
+"""
+
+    def __init__(self, limits, window, url):
+        super().__init__(limits, window)
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.25)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self._admit_script = self._redis.register_script(self.ADMIT_SCRIPT)
+
+    @staticmethod
+    def _key(kind, client):
+        # Hash tag keeps a client's buckets in one slot for Redis Cluster scripts
+        return f"ratelimit:{{{client}}}:{kind}"
+
+    def consume(self, client, kind, amount=1, require=None):
+        require = amount if require is None else require
+        allowed, remaining, reset = super().consume(client, kind, amount, require)
+        if not allowed:
+            return allowed, remaining, reset
+
+        capacity = self.limits[kind]
+        rate = self._rate(kind)
+        try:
+            shared_allowed, tokens = self._script(
+                keys=[self._key(kind, client)],
+                args=[capacity, rate, amount, require, time.time()]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Shared rate limit backend unavailable, using local limits: {str(e)}")
+            return allowed, remaining, reset
+
+        tokens = float(tokens)
+        return (bool(shared_allowed), max(0, int(tokens)),
+                self._reset_after(tokens, require, capacity, rate))
+
+    def admit(self, client):
+        allowed, remaining, reset = super().admit(client)
+        if not allowed:
+            return allowed, remaining, reset
+
+        request_rate = self._rate('requests')
+        token_rate = self._rate('tokens')
+        try:
+            shared_allowed, requests_left, tokens_left = self._admit_script(
+                keys=[self._key('requests', client), self._key('tokens', client)],
+                args=[self.limits['requests'], request_rate, self.limits['tokens'], token_rate, time.time()]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Shared rate limit backend unavailable, using local limits: {str(e)}")
+            return allowed, remaining, reset
+
+        requests_left = float(requests_left)
+        tokens_left = float(tokens_left)
+        if tokens_left < 1:
+            reset = self._reset_after(tokens_left, 1, self.limits['tokens'], token_rate)
+        else:
+            reset = self._reset_after(requests_left, 1, self.limits['requests'], request_rate)
+        return bool(shared_allowed), max(0, int(requests_left)), reset
+
+def create_rate_limiter(settings):
+    """Build the rate limiter configured in ``settings`` (an app's config)."""
+    limits = {'requests': settings['RATE_LIMIT_REQUESTS'], 'tokens': settings['RATE_LIMIT_TOKENS']}
+    if settings['RATE_LIMIT_REDIS_URL']:
+        if redis is None:
+            logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; using in-memory limits")
+        else:
+            return RedisRateLimiter(limits, settings['RATE_LIMIT_WINDOW'], settings['RATE_LIMIT_REDIS_URL'])
+    return RateLimiter(limits, settings['RATE_LIMIT_WINDOW'])
+
+def get_client_id():
+    """Identify the caller by a configured API key, falling back to the remote address.
+
+    Unknown keys are ignored: otherwise a client could get a fresh quota just
+    by sending a new ``X-API-Key`` with every request.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in current_app.config['API_KEYS']:
+        return f"key:{api_key}"
+    return f"ip:{request.remote_addr}"
+
+def rate_limited(view):
+    """Apply per-client request and generated-token quotas to an endpoint.
+
+    Views report how many tokens they generated through ``g.generated_tokens``;
+    those are charged to the client's token bucket once the view returns.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config['RATE_LIMIT_ENABLED']:
+            return view(*args, **kwargs)
+
+        rate_limiter = current_app.extensions['rate_limiter']
+        client = get_client_id()
+        allowed, remaining, reset = rate_limiter.admit(client)
+
+        if not allowed:
+            retry_after = max(1, reset)
+            response = jsonify({
+                'error': 'Rate limit exceeded',
+                'response': f'Too many requests. Please wait {retry_after} seconds and try again.'
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            _set_rate_limit_headers(response, remaining, reset)
+            return response
+
+        g.generated_tokens = 0
+        response = make_response(view(*args, **kwargs))
+        if g.generated_tokens:
+            rate_limiter.consume(client, 'tokens', amount=g.generated_tokens, require=0)
+        _set_rate_limit_headers(response, remaining, reset)
+        return response
+
+    return wrapper
+
+class TrafficRecorder:
+    """Appends one compact JSON line per recorded request for later replay.
+
+    Each line holds the arrival time, status, end-to-end and upstream
+    latency, generated tokens and the conversation. With ``redact`` the
+    message and history contents are replaced by their lengths, which keeps
+    prompt sizes for replay without storing what users wrote.
+    """
+
+    def __init__(self, path, redact=True, sample_rate=1.0):
+        self.path = path
+        self.redact = redact
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def record(self, entry):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._pid != os.getpid():
+                # Worker processes each get their own append handle
+                self._file = open(self.path, 'a', encoding='utf-8')
+                self._pid = os.getpid()
+            self._file.write(line)
+            self._file.flush()
+
+    def conversation(self, body):
+        """Return the (possibly redacted) message and history of a request body."""
+        message = body.get('message')
+        history = body.get('history') or []
+        if not self.redact:
+            return message, history
+        return (
+            len(message) if isinstance(message, str) else 0,
+            [[m.get('role'), len(m.get('content') or '')] for m in history if isinstance(m, dict)]
+        )
 
-@app.route('/')
+def recorded(view):
+    """Record each request to the endpoint with the app's TrafficRecorder.
+
+    Views report upstream time through ``g.upstream_ms`` and cache hits
+    through ``g.cached``; generated tokens come from ``g.generated_tokens``.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        recorder = current_app.extensions['traffic']
+        if recorder is None:
+            return view(*args, **kwargs)
+
+        arrived = time.time()
+        started = time.perf_counter()
+        response = make_response(view(*args, **kwargs))
+
+        body = g.get('json_body')
+        message, history = recorder.conversation(body if isinstance(body, dict) else {})
+        recorder.record({
+            't': round(arrived, 3),
+            'path': request.path,
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'upstream_ms': g.get('upstream_ms'),
+            'tokens': g.get('generated_tokens') or 0,
+            'cached': g.get('cached', False),
+            'message': message,
+            'history': history
+        })
+        return response
+
+    return wrapper
+
+def _set_rate_limit_headers(response, remaining, reset):
+    response.headers['X-RateLimit-Limit'] = str(current_app.config['RATE_LIMIT_REQUESTS'])
+    response.headers['X-RateLimit-Remaining'] = str(remaining)
+    response.headers['X-RateLimit-Reset'] = str(reset)
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def payload_too_large(e):
+    """Report oversized requests as JSON."""
+    return jsonify({
+        'error': e.description,
+        'response': 'Sorry, your message or conversation is too long. Please shorten it or clear the chat and try again.'
+    }), 413
+
+@bp.app_errorhandler(BadRequest)
+def bad_request(e):
+    """Report malformed requests as JSON."""
+    return jsonify({'error': e.description}), 400
+
+@bp.route('/')
 def index():
     """Serve the main chat interface."""
-    return render_template_string(HTML_TEMPLATE, model_name=Config.MODEL_NAME)
+    return render_template_string(HTML_TEMPLATE, model_name=current_app.config['MODEL_NAME'],
+                                  status_interval=current_app.config['STATUS_INTERVAL'])
 
-@app.route('/api/chat', methods=['POST'])
+@bp.route('/api/chat', methods=['POST'])
+@recorded
+@rate_limited
 def chat():
     """Handle chat messages and return AI responses."""
     try:
-        data = request.get_json()
+        data = read_json_body(chat_request_schema())
 
         if not data or 'message' not in data:
             return jsonify({'error': 'No message provided'}), 400
@@ -811,15 +2989,38 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Empty message'}), 400
 
-        # Check Ollama connection
-        if not check_ollama_connection():
+        prefetcher = current_app.extensions['prefetcher']
+        messages = build_messages(user_message, history)
+
+        if 'format' in data or 'tools' in data:
+            return structured_chat(messages, data.get('format'), data.get('tools'), prefetcher)
+
+        prefetcher.observe(messages)
+
+        # Serve speculatively prefetched answers without touching Ollama
+        cached = prefetcher.cache.get(ResponseCache.key(current_app.config['MODEL_NAME'], messages))
+        if cached is not None:
+            g.cached = True
+            prefetcher.schedule(messages, cached, current_app.config['MODEL_NAME'])
             return jsonify({
-                'error': 'Ollama server not accessible',
-                'response': f'Sorry, I cannot connect to the Ollama server. Please make sure Ollama is running on {Config.OLLAMA_BASE_URL} and the {Config.MODEL_NAME} model is available.'
-            }), 503
+                'response': cached,
+                'status': 'success',
+                'model': current_app.config['MODEL_NAME'],
+                'cached': True
+            })
+
+        with prefetcher.foreground():
+            # Check Ollama connection
+            if not check_ollama_connection():
+                return jsonify({
+                    'error': 'Ollama server not accessible',
+                    'response': f"Sorry, I cannot connect to the Ollama server. Please make sure Ollama is running on {current_app.config['OLLAMA_BASE_URL']} and the {current_app.config['MODEL_NAME']} model is available."
+                }), 503
 
-        # Get response from Ollama
-        ai_response = get_ollama_response(user_message, history)
+            # Get response from Ollama
+            upstream_started = time.perf_counter()
+            ai_response, usage = get_ollama_response(user_message, history)
+            g.upstream_ms = round((time.perf_counter() - upstream_started) * 1000, 1)
 
         if ai_response is None:
             return jsonify({
@@ -827,12 +3028,17 @@ def chat():
                 'response': 'Sorry, I encountered an error while processing your message. Please try again.'
             }), 500
 
+        g.generated_tokens = usage.get('completion_tokens') or estimate_tokens(ai_response)
+        prefetcher.schedule(messages, ai_response, current_app.config['MODEL_NAME'])
+
         return jsonify({
             'response': ai_response,
             'status': 'success',
-            'model': Config.MODEL_NAME
+            'model': current_app.config['MODEL_NAME']
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat endpoint error: {str(e)}")
         return jsonify({
@@ -840,27 +3046,265 @@ def chat():
             'response': 'Sorry, an unexpected error occurred. Please try again.'
         }), 500
 
-@app.route('/api/health', methods=['GET'])
+def structured_chat(messages, response_format, tools, prefetcher):
+    """Answer a /api/chat request that asked for JSON output or tool calls."""
+    if response_format is not None and response_format != 'json' and not isinstance(response_format, dict):
+        return jsonify({'error': "'format' must be \"json\" or a JSON schema object"}), 400
+    if tools is not None and not (isinstance(tools, list) and all(isinstance(t, dict) for t in tools)):
+        return jsonify({'error': "'tools' must be a list of tool definitions"}), 400
+
+    with prefetcher.foreground():
+        if not check_ollama_connection():
+            return jsonify({
+                'error': 'Ollama server not accessible',
+                'response': f"Sorry, I cannot connect to the Ollama server. Please make sure Ollama is running on {current_app.config['OLLAMA_BASE_URL']} and the {current_app.config['MODEL_NAME']} model is available."
+            }), 503
+
+        upstream_started = time.perf_counter()
+        try:
+            result, usage = get_structured_response(messages, response_format, tools)
+        except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+            logger.error(f"Structured output request error: {str(e)}")
+            return jsonify({
+                'error': 'Failed to get AI response',
+                'response': 'Sorry, I encountered an error while processing your message. Please try again.'
+            }), 500
+        g.upstream_ms = round((time.perf_counter() - upstream_started) * 1000, 1)
+
+    g.generated_tokens = usage.get('completion_tokens', 0)
+
+    if result is None:
+        return jsonify({
+            'error': 'Model output did not match the requested format',
+            'response': 'Sorry, I could not produce a valid structured response. Please try again.'
+        }), 422
+
+    response = {
+        'response': result['content'],
+        'status': 'success',
+        'model': current_app.config['MODEL_NAME']
+    }
+    if 'data' in result:
+        response['data'] = result['data']
+    if 'tool_calls' in result:
+        response['tool_calls'] = result['tool_calls']
+    return jsonify(response)
+
+@bp.route('/api/chat/compare', methods=['POST'])
+@rate_limited
+def chat_compare():
+    """Send one conversation to several models at once and stream every answer.
+
+    The response is a server-sent event stream: ``token`` events carry content
+    for one model, ``done`` events its TTFT / tokens-per-second / total time,
+    ``error`` events a per-model failure and a final ``end`` event the summary.
+    """
+    data = read_json_body(chat_request_schema())
+
+    if not data or 'message' not in data:
+        return jsonify({'error': 'No message provided'}), 400
+
+    user_message = data['message'].strip()
+    history = data.get('history', [])
+    models = data.get('models')
+
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+
+    if not isinstance(models, list) or not models or not all(isinstance(m, str) and m for m in models):
+        return jsonify({'error': 'Provide a non-empty list of model names'}), 400
+
+    models = list(dict.fromkeys(models))
+    max_models = current_app.config['COMPARE_MAX_MODELS']
+    if len(models) > max_models:
+        return jsonify({'error': f'At most {max_models} models can be compared at once'}), 400
+
+    if not check_ollama_connection():
+        return jsonify({'error': 'Ollama server not accessible'}), 503
+
+    messages = build_messages(user_message, history)
+    rate_limiter = current_app.extensions['rate_limiter']
+    prefetcher = current_app.extensions['prefetcher']
+    client = get_client_id()
+    rate_limit_enabled = current_app.config['RATE_LIMIT_ENABLED']
+    app = current_app._get_current_object()
+
+    def compare_in_app(model):
+        with app.app_context():
+            compare_model(model, messages, events, cancelled)
+
+    def generate():
+        with prefetcher.foreground():
+            yield from stream_comparison()
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def stream_comparison():
+        executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix='compare')
+        for model in models:
+            executor.submit(compare_in_app, model)
+
+        results = []
+        pending = len(models)
+        try:
+            while pending:
+                event, payload = events.get()
+                if event in ('done', 'error'):
+                    pending -= 1
+                    results.append(payload)
+                yield sse_event(event, payload)
+            yield sse_event('end', {'results': results})
+        finally:
+            # Stop the remaining streams if the client went away
+            cancelled.set()
+            executor.shutdown(wait=False)
+            generated = sum(r.get('tokens', 0) for r in results)
+            if rate_limit_enabled and generated:
+                rate_limiter.consume(client, 'tokens', amount=generated, require=0)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.before_app_request
+def start_job_workers():
+    """Make sure this process is working through the job queue."""
+    current_app.extensions['jobs'].start()
+
+@bp.route('/api/jobs', methods=['POST'])
+@rate_limited
+def submit_job():
+    """Queue a long generation and return immediately with its job id."""
+    data = read_json_body(job_request_schema())
+
+    if not data or 'message' not in data:
+        return jsonify({'error': 'No message provided'}), 400
+
+    user_message = data['message'].strip()
+    history = data.get('history', [])
+    model = data.get('model') or current_app.config['MODEL_NAME']
+    callback_url = data.get('callback_url')
+
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+
+    if callback_url and not is_local_callback(callback_url):
+        return jsonify({'error': f"callback_url must point to one of: {', '.join(current_app.config['JOBS_CALLBACK_HOSTS'])}"}), 400
+
+    job_id = current_app.extensions['jobs'].submit(
+        build_messages(user_message, history), model, client=get_client_id(), callback_url=callback_url
+    )
+
+    return jsonify({
+        'id': job_id,
+        'status': 'queued',
+        'status_url': f"/api/jobs/{job_id}",
+        'stream_url': f"/api/jobs/{job_id}/stream"
+    }), 202
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a job's status; completed jobs include the full response."""
+    job = current_app.extensions['jobs'].get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    jobs = current_app.extensions['jobs']
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not jobs.cancel(job_id):
+        return jsonify({'error': f"Job is already {job['status']}"}), 409
+    return jsonify(jobs.get(job_id))
+
+@bp.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """Send a job's new output as server-sent events, starting at ``?offset=N`` tokens.
+
+    ``token`` events carry ``offset`` and ``content``; a ``reset`` event means
+    the job was restarted and its output begins again at offset 0. Each
+    response holds only what is stored so far and then closes; EventSource
+    clients reconnect after the ``retry`` delay and resume from the
+    ``Last-Event-ID`` header (``attempt:next_offset``), so no server thread
+    waits on a running job. The final response ends with a ``done`` event
+    holding the job status.
+    """
+    jobs = current_app.extensions['jobs']
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    attempt = job['attempt']
+    client_attempt = attempt
+    offset = max(0, request.args.get('offset', 0, type=int))
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id:
+        try:
+            client_attempt, offset = (int(part) for part in last_event_id.split(':'))
+        except ValueError:
+            return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    events = [f"retry: {JobQueue.STREAM_RETRY_MS}\n\n"]
+    if client_attempt != attempt:
+        offset = 0
+        events.append(sse_event('reset', {'attempt': attempt}, event_id=f"{attempt}:0"))
+    for seq, content in jobs.chunks(job_id, offset):
+        events.append(sse_event('token', {'offset': seq, 'content': content}, event_id=f"{attempt}:{seq + 1}"))
+    if job['status'] in JobQueue.FINISHED:
+        events.append(sse_event('done', job))
+
+    return Response(''.join(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint to verify server and Ollama status."""
-    ollama_status = check_ollama_connection()
+    status, _ = current_app.extensions['status'].snapshot()
 
     return jsonify({
         'server': 'running',
-        'ollama': 'connected' if ollama_status else 'disconnected',
-        'model': Config.MODEL_NAME,
-        'ollama_url': Config.OLLAMA_BASE_URL,
+        'ollama': status['ollama'],
+        'model': current_app.config['MODEL_NAME'],
+        'model_available': status['model_available'],
+        'ollama_url': current_app.config['OLLAMA_BASE_URL'],
         'timestamp': request.environ.get('HTTP_DATE', 'unknown')
     })
 
-@app.route('/api/models', methods=['GET'])
+@bp.route('/api/status/stream', methods=['GET'])
+def status_stream():
+    """Send the Ollama status as a server-sent event if it changed, then close.
+
+    EventSource clients reconnect every ``STATUS_INTERVAL`` seconds (the
+    ``retry`` field) with the last event id, so a status is sent only when it
+    differs from what the client already has and no thread is held between
+    updates.
+    """
+    status, version = current_app.extensions['status'].snapshot()
+    body = f"retry: {current_app.config['STATUS_INTERVAL'] * 1000}\n\n"
+    if request.headers.get('Last-Event-ID') != str(version):
+        body += sse_event('status', status, event_id=version)
+
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/models', methods=['GET'])
 def list_models():
     """List available Ollama models."""
     try:
         if not check_ollama_connection():
             return jsonify({'error': 'Ollama server not accessible'}), 503
 
-        response = requests.get(f"{Config.OLLAMA_BASE_URL}/api/tags", timeout=10)
+        response = get_ollama_session().get(f"{current_app.config['OLLAMA_BASE_URL']}/api/tags", timeout=10)
 
         if response.status_code == 200:
             return response.json()
@@ -871,16 +3315,150 @@ def list_models():
         logger.error(f"Models endpoint error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-if __name__ == '__main__':
+def create_app(config=None):
+    """Application factory.
+
+    ``config`` may be a dict or an object with upper-case attributes; its values
+    override settings read from the environment (and a ``.env`` file). Every
+    app gets its own ``app.config``, so several apps can coexist in a process.
+    """
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    app = Flask(__name__)
+    app.config.from_mapping(Config.from_env())
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+    settings = app.config
+
+    if settings['CORS_ORIGINS']:
+        CORS(app, origins=settings['CORS_ORIGINS'], expose_headers=[
+            'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset', 'Retry-After'
+        ])
+    app.extensions['rate_limiter'] = create_rate_limiter(settings)
+    app.extensions['prefetcher'] = PrefetchEngine(
+        app,
+        ResponseCache(settings['RESPONSE_CACHE_SIZE'], settings['RESPONSE_CACHE_TTL']),
+        enabled=settings['PREFETCH_ENABLED'],
+        top_k=settings['PREFETCH_TOP_K'],
+        suggestions=load_prefetch_suggestions(settings['PREFETCH_SUGGESTIONS_FILE'])
+    )
+    app.extensions['status'] = StatusMonitor(settings['STATUS_INTERVAL'])
+    app.extensions['traffic'] = TrafficRecorder(
+        settings['TRAFFIC_LOG_PATH'],
+        redact=settings['TRAFFIC_LOG_REDACT'],
+        sample_rate=settings['TRAFFIC_LOG_SAMPLE']
+    ) if settings['TRAFFIC_LOG_PATH'] else None
+    app.extensions['jobs'] = JobQueue(
+        app,
+        settings['JOBS_DB_PATH'],
+        workers=settings['JOBS_WORKERS'],
+        lease=settings['JOBS_LEASE'],
+        retention=settings['JOBS_RETENTION'],
+        rate_limiter=app.extensions['rate_limiter'] if settings['RATE_LIMIT_ENABLED'] else None
+    )
+    app.register_blueprint(bp)
+    return app
+
+def serve(app, host, port, workers, threads, graceful_timeout):
+    """Run the app under a pre-forking gunicorn server.
+
+    The app is loaded once in the master and shared copy-on-write with the
+    workers; each worker warms its own Ollama connection and starts its job
+    queue threads after forking.
+    SIGTERM stops accepting connections and lets in-flight requests finish
+    within ``graceful_timeout`` seconds.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.warning("gunicorn is not installed; falling back to a single multi-threaded process. "
+                       "Run `pip install gunicorn` for multi-process serving.")
+        app.extensions['jobs'].start()
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+
+    if workers > 1 and app.extensions['prefetcher'].enabled:
+        # Each worker would only see its own traffic and cache: prefetches
+        # would compete with requests served by other workers, and their
+        # answers would miss whenever the follow-up lands elsewhere
+        logger.warning("PREFETCH_ENABLED is ignored with more than one worker process; "
+                       "use --workers 1 to prefetch follow-ups")
+        app.extensions['prefetcher'].enabled = False
+
+    def post_fork(server, worker):
+        with app.app_context():
+            warm_ollama_client()
+        app.extensions['jobs'].start()
+
+    class ChatAgentServer(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    ChatAgentServer(app, {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': True,
+        'graceful_timeout': graceful_timeout,
+        # Generations can take a while; don't let the arbiter kill busy workers
+        'timeout': max(120, graceful_timeout),
+        'post_fork': post_fork,
+    }).run()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Personal AI Chat Agent")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help="Run the Flask development server (default)")
+    serve_parser = subparsers.add_parser('serve', help="Run the multi-process production server")
+    serve_parser.add_argument('--host', help="Bind address (default: FLASK_HOST)")
+    serve_parser.add_argument('--port', type=int, help="Bind port (default: FLASK_PORT)")
+    serve_parser.add_argument('--workers', type=int, help="Worker processes (default: WORKERS or CPU count)")
+    serve_parser.add_argument('--threads', type=int, help="Threads per worker (default: THREADS)")
+    serve_parser.add_argument('--graceful-timeout', type=int,
+                              help="Seconds to drain connections on SIGTERM (default: GRACEFUL_TIMEOUT)")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    settings = app.config
+    host = getattr(args, 'host', None) or settings['FLASK_HOST']
+    port = getattr(args, 'port', None) or settings['FLASK_PORT']
+
     logger.info("Starting Personal AI Chat Agent (Advanced Version)...")
-    logger.info(f"Connecting to Ollama at: {Config.OLLAMA_BASE_URL}")
-    logger.info(f"Using model: {Config.MODEL_NAME}")
-    logger.info(f"Server will run on: {Config.FLASK_HOST}:{Config.FLASK_PORT}")
+    logger.info(f"Connecting to Ollama at: {settings['OLLAMA_BASE_URL']}")
+    logger.info(f"Using model: {settings['MODEL_NAME']}")
+    logger.info(f"Server will run on: {host}:{port}")
 
     # Check initial Ollama connection
-    if check_ollama_connection():
+    with app.app_context():
+        connected = check_ollama_connection()
+    if connected:
         logger.info("✅ Ollama connection successful")
     else:
         logger.warning("⚠️  Ollama connection failed - please ensure Ollama is running")
 
-    app.run(host=Config.FLASK_HOST, port=Config.FLASK_PORT, debug=Config.DEBUG)
\ No newline at end of file
+    if args.command == 'serve':
+        serve(app, host, port,
+              workers=args.workers or settings['WORKERS'],
+              threads=args.threads or settings['THREADS'],
+              graceful_timeout=args.graceful_timeout or settings['GRACEFUL_TIMEOUT'])
+    else:
+        # Resume queued jobs right away; with the reloader, only in the serving child
+        if not settings['DEBUG'] or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            app.extensions['jobs'].start()
+        app.run(host=host, port=port, debug=settings['DEBUG'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Memory benchmark: RSS of the chat app under adversarial request payloads.
+
+Sends oversized and hostile bodies to /api/chat through Flask's test client
+(no network or Ollama needed) and prints the process RSS after each case.
+Bodies are generated lazily, so the benchmark itself never holds them in
+memory; a flat RSS column means the server rejected them without buffering.
+
+    python bench_memory.py [--rounds 5] [--body-limit 67108864]
+"""
+
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from app_advanced import create_app
+
+MB = 1024 * 1024
+
+
+class GeneratedBody(io.RawIOBase):
+    """A request body of ``prefix + filler * count + suffix`` produced on the fly."""
+
+    def __init__(self, prefix, filler, count, suffix):
+        self.prefix = prefix
+        self.filler = filler
+        self.count = count
+        self.suffix = suffix
+        self.length = len(prefix) + len(filler) * count + len(suffix)
+        self._segments = self._generate()
+        self._buffer = b''
+        self._position = 0
+
+    def _generate(self):
+        yield self.prefix
+        batch = max(1, 64 * 1024 // max(1, len(self.filler)))
+        remaining = self.count
+        while remaining:
+            n = min(batch, remaining)
+            yield self.filler * n
+            remaining -= n
+        yield self.suffix
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Only supports the size probe done by the test client before reading
+        self._position = self.length + offset if whence == io.SEEK_END else offset
+        return self._position
+
+    def readinto(self, target):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._segments)
+            except StopIteration:
+                return 0
+        n = min(len(target), len(self._buffer))
+        target[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux), falling back to peak RSS."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / MB
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / MB if sys.platform == 'darwin' else peak / 1024
+
+
+def cases(body_limit):
+    """Adversarial payloads: (name, body factory, send Content-Length)."""
+    history_entry = b'{"role": "user", "content": "hi"},'
+    return [
+        ('huge declared body', lambda: GeneratedBody(b'{"message": "', b'x', 4 * body_limit, b'"}'), True),
+        ('huge chunked body', lambda: GeneratedBody(b'{"message": "', b'x', 4 * body_limit, b'"}'), False),
+        ('one very long message', lambda: GeneratedBody(b'{"message": "', b'x', body_limit - 64, b'"}'), True),
+        ('1M history entries', lambda: GeneratedBody(
+            b'{"message": "hi", "history": [', history_entry, 1000000, b'{"role": "user", "content": "hi"}]}'
+        ), False),
+        ('long history message', lambda: GeneratedBody(
+            b'{"message": "hi", "history": [{"role": "user", "content": "', b'y', body_limit - 128, b'"}]}'
+        ), True),
+        ('deep nesting', lambda: GeneratedBody(b'{"message": "hi", "extra": ', b'[', body_limit // 2, b''), True),
+        ('large array', lambda: GeneratedBody(b'{"message": "hi", "extra": [', b'1,', body_limit // 2 - 32, b'1]}'), True),
+        ('invalid UTF-8', lambda: GeneratedBody(b'{"message": "', b'\xff', body_limit // 2, b'"}'), True),
+    ]
+
+
+def run(rounds, body_limit):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'MAX_CONTENT_LENGTH': body_limit,
+            'RATE_LIMIT_ENABLED': False,
+            'JOBS_WORKERS': 0,
+            'JOBS_DB_PATH': os.path.join(tmp, 'jobs.db')
+        })
+        client = app.test_client()
+
+        baseline = current_rss_mb()
+        print(f"Body limit: {body_limit / MB:.1f} MB, rounds per case: {rounds}")
+        print(f"Baseline RSS: {baseline:.1f} MB\n")
+        print(f"{'case':<24}{'body MB':>10}{'status':>8}{'ms/req':>9}{'RSS MB':>10}{'delta':>9}")
+
+        for name, make_body, with_length in cases(body_limit):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                body = make_body()
+                environ = {}
+                if not with_length:
+                    # What a server that de-chunks requests itself (e.g. gunicorn) passes on
+                    environ = {'HTTP_TRANSFER_ENCODING': 'chunked', 'wsgi.input_terminated': True}
+                response = client.post('/api/chat', content_type='application/json',
+                                       input_stream=body, environ_overrides=environ)
+            elapsed = (time.perf_counter() - started) * 1000 / rounds
+            rss = current_rss_mb()
+            print(f"{name:<24}{body.length / MB:>10.1f}{response.status_code:>8}{elapsed:>9.1f}"
+                  f"{rss:>10.1f}{rss - baseline:>+9.1f}")
+
+        print(f"\nPeak RSS: {peak_rss_mb():.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure RSS of the chat app under adversarial payloads")
+    parser.add_argument('--rounds', type=int, default=5, help="Requests per case (default: 5)")
+    parser.add_argument('--body-limit', type=int, default=8 * MB,
+                        help="MAX_CONTENT_LENGTH for the run (default: 8 MB, above the default limit to "
+                             "exercise the streaming parser)")
+    args = parser.parse_args(argv)
+    run(args.rounds, args.body_limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""Replay recorded /api/chat traffic for capacity planning.
+
+Reads the log written when TRAFFIC_LOG_PATH is set and re-sends every
+request open loop: each one goes out at its recorded offset divided by
+``--speedup``, whether or not earlier requests have finished, and latency is
+measured from that scheduled time so a saturated server shows up as queueing
+instead of a slower send rate. Redacted entries are rebuilt with filler text
+of the recorded lengths.
+
+    python replay_traffic.py traffic.jsonl --target http://localhost:5000 --speedup 4
+
+``--stand-in PORT`` starts a fake Ollama that answers after each request's
+recorded upstream time, so the Flask tier can be sized without a GPU:
+
+    python replay_traffic.py traffic.jsonl --stand-in 11500
+    OLLAMA_BASE_URL=http://localhost:11500 python app_advanced.py serve
+    python replay_traffic.py traffic.jsonl --target http://localhost:5000 --speedup 10
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+         'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'magna')
+
+
+def load_entries(path, limit=None):
+    """Read a traffic log (optionally gzipped), sorted by arrival time."""
+    opener = gzip.open if path.endswith('.gz') else open
+    entries = []
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping malformed line: {line[:80]}", file=sys.stderr)
+    entries.sort(key=lambda e: e['t'])
+    return entries[:limit] if limit else entries
+
+
+def filler(length, rng):
+    """Deterministic placeholder text of exactly ``length`` characters."""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)[:length]
+
+
+def rebuild_body(entry, index):
+    """Turn a recorded entry back into an /api/chat request body."""
+    rng = random.Random(index)
+    message = entry.get('message')
+    if isinstance(message, int):
+        message = filler(message, rng)
+    history = []
+    for item in entry.get('history') or []:
+        if isinstance(item, list):
+            role, length = item
+            history.append({'role': role, 'content': filler(length, rng)})
+        else:
+            history.append(item)
+    # Prefix with the index so every replayed prompt is unique (no accidental cache hits)
+    message = f"[{index}] {message or ''}"
+    if history and history[-1].get('role') == 'user':
+        history[-1] = {'role': 'user', 'content': message}
+    return {'message': message, 'history': history}
+
+
+def last_user_content(messages):
+    for m in reversed(messages or []):
+        if m.get('role') == 'user':
+            return m.get('content')
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': ordered[-1]}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Fake Ollama answering after the recorded upstream time of each prompt."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self, messages):
+        server = self.server
+        delay_ms = server.delays.get(last_user_content(messages), server.default_delay)
+        with server.slots:
+            time.sleep(delay_ms / 1000)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': self.server.model}]})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        messages = payload.get('messages') or []
+        reply = filler(200, random.Random(len(messages)))
+
+        if self.path == '/v1/chat/completions':
+            self._delay(messages)
+            self._send_json({
+                'choices': [{'message': {'role': 'assistant', 'content': reply}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 50, 'total_tokens': 50}
+            })
+        elif self.path == '/api/chat':
+            self._delay(messages)
+            lines = [
+                {'message': {'role': 'assistant', 'content': reply}, 'done': False},
+                {'message': {'role': 'assistant', 'content': ''}, 'done': True, 'eval_count': 50}
+            ]
+            body = ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+
+def start_stand_in(entries, port, parallel, model):
+    """Serve the fake Ollama in a background thread and return the server."""
+    server = ThreadingHTTPServer(('0.0.0.0', port), StandInHandler)
+    server.daemon_threads = True
+    upstream = [e['upstream_ms'] for e in entries if e.get('upstream_ms')]
+    server.default_delay = statistics.median(upstream) if upstream else 0
+    server.delays = {}
+    for index, entry in enumerate(entries):
+        if entry.get('cached'):
+            # Served from the app's cache when recorded; answer at once so
+            # replay doesn't add upstream time the recording never had
+            server.delays[rebuild_body(entry, index)['message']] = 0
+        elif entry.get('upstream_ms'):
+            server.delays[rebuild_body(entry, index)['message']] = entry['upstream_ms']
+    # Ollama serves a fixed number of generations at once (OLLAMA_NUM_PARALLEL)
+    server.slots = threading.BoundedSemaphore(parallel)
+    server.model = model
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Stand-in Ollama on port {port} (median upstream {server.default_delay:.0f} ms, "
+          f"{parallel} parallel)")
+    return server
+
+
+def replay(entries, target, speedup, concurrency, timeout):
+    """Send every entry at its scheduled time; return (latencies_ms, statuses, wall_s)."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    url = target.rstrip('/') + '/api/chat'
+
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    first = entries[0]['t']
+    start = time.perf_counter()
+
+    def send(index, entry, scheduled):
+        try:
+            status = session.post(url, json=rebuild_body(entry, index), timeout=timeout).status_code
+        except requests.exceptions.RequestException:
+            status = 0
+        elapsed = (time.perf_counter() - scheduled) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses.append(status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, entry in enumerate(entries):
+            scheduled = start + (entry['t'] - first) / speedup
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(send, index, entry, scheduled)
+
+    return latencies, statuses, time.perf_counter() - start
+
+
+def report(entries, latencies, statuses, wall, speedup):
+    span = entries[-1]['t'] - entries[0]['t']
+    recorded_rps = len(entries) / span if span > 0 else float('inf')
+    errors = sum(1 for s in statuses if s == 0 or s >= 500)
+    limited = sum(1 for s in statuses if s == 429)
+
+    print(f"\nRequests: {len(statuses)}  errors: {errors}  rate limited: {limited}")
+    print(f"Throughput: {len(statuses) / wall:.1f} req/s replayed, "
+          f"{recorded_rps * speedup:.1f} req/s offered ({recorded_rps:.2f} recorded x {speedup:g})")
+    print(f"\n{'latency ms':<12}{'recorded':>12}{'replayed':>12}")
+    before = percentiles([e['latency_ms'] for e in entries if e.get('latency_ms') is not None])
+    after = percentiles(latencies)
+    for key in ('p50', 'p90', 'p99', 'max'):
+        print(f"{key:<12}{before.get(key, 0):>12.1f}{after.get(key, 0):>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded /api/chat traffic")
+    parser.add_argument('log', help="Traffic log written via TRAFFIC_LOG_PATH (.jsonl or .jsonl.gz)")
+    parser.add_argument('--target', help="Base URL of the app to replay against")
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help="Compress recorded inter-arrival times by this factor (default: 1)")
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help="Maximum requests in flight (default: 256)")
+    parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument('--stand-in', type=int, metavar='PORT',
+                        help="Serve a fake Ollama on PORT using the recorded upstream times")
+    parser.add_argument('--stand-in-parallel', type=int, default=4,
+                        help="Generations the stand-in serves at once (default: 4)")
+    parser.add_argument('--model', default=os.getenv('MODEL_NAME', 'gemma3:1b'),
+                        help="Model name the stand-in reports (default: MODEL_NAME or the app's default)")
+    args = parser.parse_args(argv)
+
+    entries = load_entries(args.log, args.limit)
+    if not entries:
+        parser.error(f"No entries in {args.log}")
+
+    if args.stand_in:
+        start_stand_in(entries, args.stand_in, args.stand_in_parallel, args.model)
+        if not args.target:
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                return
+    elif not args.target:
+        parser.error("--target is required unless --stand-in is given")
+
+    print(f"Replaying {len(entries)} requests against {args.target} at {args.speedup:g}x")
+    latencies, statuses, wall = replay(entries, args.target, args.speedup, args.concurrency, args.timeout)
+    report(entries, latencies, statuses, wall, args.speedup)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from app_advanced import RateLimiter, create_app, get_client_id
+
+
+@pytest.fixture
+def app(tmp_path):
+    return create_app({
+        'API_KEYS': ['team-key'],
+        'JOBS_WORKERS': 0,
+        'JOBS_DB_PATH': str(tmp_path / 'jobs.db')
+    })
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({'X-API-Key': 'team-key'}, 'key:team-key'),
+    ({'X-API-Key': 'made-up'}, 'ip:10.0.0.1'),
+    ({}, 'ip:10.0.0.1'),
+])
+def test_client_id_trusts_only_configured_keys(app, headers, expected):
+    with app.test_request_context(headers=headers, environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert get_client_id() == expected
+
+
+def limiter(requests=2, tokens=100, window=60, cls=RateLimiter):
+    return cls({'requests': requests, 'tokens': tokens}, window)
+
+
+def test_admit_until_the_request_quota_is_empty():
+    rate_limiter = limiter(requests=2)
+    assert rate_limiter.admit('a')[:2] == (True, 1)
+    assert rate_limiter.admit('a')[:2] == (True, 0)
+    allowed, remaining, reset = rate_limiter.admit('a')
+    assert (allowed, remaining) == (False, 0)
+    # One request refills every 30 seconds
+    assert reset == 30
+    assert rate_limiter.admit('b')[0]
+
+
+def test_generated_tokens_put_the_client_in_debt():
+    rate_limiter = limiter(requests=10, tokens=100)
+    assert rate_limiter.consume('a', 'tokens', amount=250, require=0)[0]
+    allowed, remaining, reset = rate_limiter.admit('a')
+    assert not allowed
+    assert remaining == 10
+    # 151 tokens short at 100 tokens a minute
+    assert reset == 91
+    assert rate_limiter.peek('a', 'requests') == (10, 0)
+
+
+class TinyRateLimiter(RateLimiter):
+    STRIPES = 1
+    MAX_BUCKETS = 2
+
+
+def test_least_recently_used_bucket_is_evicted():
+    rate_limiter = limiter(requests=1, cls=TinyRateLimiter)
+    assert rate_limiter.consume('a', 'requests')[0]
+    assert rate_limiter.consume('b', 'requests')[0]
+    assert not rate_limiter.consume('a', 'requests')[0]
+    # 'b' is now the oldest bucket and makes room for 'c'
+    assert rate_limiter.consume('c', 'requests')[0]
+    assert rate_limiter.consume('b', 'requests')[0]
+    assert not rate_limiter.consume('c', 'requests')[0]
+
+
+def test_bucket_count_stays_bounded():
+    rate_limiter = limiter()
+    start = time.perf_counter()
+    for i in range(2 * RateLimiter.MAX_BUCKETS):
+        rate_limiter.consume(f'client-{i}', 'requests')
+    assert time.perf_counter() - start < 10
+    assert sum(len(buckets) for buckets in rate_limiter._buckets) <= RateLimiter.MAX_BUCKETS
+
+
+def test_exhausted_client_gets_429_with_retry_after(app):
+    app.config['RATE_LIMIT_ENABLED'] = True
+    app.extensions['rate_limiter'].consume('ip:127.0.0.1', 'requests', amount=app.config['RATE_LIMIT_REQUESTS'])
+    response = app.test_client().post('/api/chat', json={'message': 'hi'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.headers['X-RateLimit-Remaining'] == '0'
+    assert 'error' in response.get_json()
@@ -0,0 +1,48 @@
+import pytest
+
+from app_advanced import create_app
+
+ENDPOINTS = ['/api/chat', '/api/chat/compare', '/api/jobs']
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app({
+        'MAX_CONTENT_LENGTH': 4096,
+        'MAX_HISTORY_MESSAGES': 3,
+        'MAX_MESSAGE_CHARS': 100,
+        'RATE_LIMIT_ENABLED': False,
+        'JOBS_WORKERS': 0,
+        'JOBS_DB_PATH': str(tmp_path / 'jobs.db')
+    })
+    return app.test_client()
+
+
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+@pytest.mark.parametrize('body', [
+    b'{"message": "a\\xb"}',
+    b'{"message": "a\\u12"}',
+    b'{"message": "a\nb"}',
+    b'{"message": "hi"',
+    b'{"message": "hi"} {}',
+    b'{"message": "\xff"}',
+    b'{"message": 1}',
+    b'',
+])
+def test_malformed_body_is_a_json_400(client, endpoint, body):
+    response = client.post(endpoint, data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+@pytest.mark.parametrize('body', [
+    b'{"message": "' + b'x' * 8192 + b'"}',
+    b'{"message": "' + b'x' * 101 + b'"}',
+    b'{"message": "hi", "history": [' + b','.join([b'{"role": "user", "content": "hi"}'] * 4) + b']}',
+    b'{"message": "hi", "extra": ' + b'[' * 100 + b']' * 100 + b'}',
+])
+def test_oversized_body_is_a_json_413(client, endpoint, body):
+    response = client.post(endpoint, data=body, content_type='application/json')
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
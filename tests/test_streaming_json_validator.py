@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from app_advanced import LimitExceeded, SchemaMismatch, StreamingJSONValidator
+
+
+def validate(text, schema=None, chunk_size=None, **kwargs):
+    """Feed ``text`` in chunks of ``chunk_size`` characters (all at once by default)."""
+    validator = StreamingJSONValidator(schema, **kwargs)
+    step = chunk_size or len(text) or 1
+    for i in range(0, len(text), step):
+        validator.feed(text[i:i + step])
+    validator.close()
+    return validator
+
+
+def rejects(text, schema=None, error=SchemaMismatch, **kwargs):
+    for chunk_size in (None, 1, 3):
+        with pytest.raises(error):
+            validate(text, schema, chunk_size=chunk_size, **kwargs)
+
+
+@pytest.mark.parametrize('text', [
+    '{}', '[]', '"plain"', '0', '-12.5e+3', 'true', 'false', 'null',
+    '{"a": [1, 2, {"b": null}], "c": "d"}',
+    ' \n{ "a" : 1 }\t',
+])
+def test_accepts_valid_json_in_any_chunking(text):
+    for chunk_size in (None, 1, 2, 7):
+        assert validate(text, chunk_size=chunk_size).done
+
+
+@pytest.mark.parametrize('text', ['', '{', '[1,', '"open', '{"a" 1}', '[1 2]', '{} {}', 'tru', 'nul'])
+def test_rejects_incomplete_or_malformed_json(text):
+    rejects(text)
+
+
+class TestStrings:
+    @pytest.mark.parametrize('text', [r'"a\"b"', r'"a\\b"', r'"\/"', r'"\b\f\n\r\t"', r'"\u0041\u00e9"',
+                                      r'"\ud83d\ude00"', '"café ☃"'])
+    def test_accepts_valid_escapes(self, text):
+        assert validate(text, chunk_size=1).done
+
+    @pytest.mark.parametrize('text', [r'"\x"', r'"\u12"', r'"\u12g4"', r'"a\b\q"'])
+    def test_rejects_invalid_escapes(self, text):
+        rejects(text)
+
+    @pytest.mark.parametrize('char', ['\n', '\t', '\x00', '\x1f'])
+    def test_rejects_raw_control_characters(self, char):
+        rejects(f'"a{char}b"')
+        rejects(f'{{"message": "a{char}b"}}', {'type': 'object'})
+
+    def test_max_length_counts_decoded_characters(self):
+        schema = {'type': 'string', 'maxLength': 3}
+        assert validate(r'"a\n\""', schema).done
+        rejects(r'"abc\n"', schema, error=LimitExceeded)
+
+
+class TestEnums:
+    def test_escaped_value_matches_enum(self):
+        schema = {'enum': ['bob', 'café', '\U0001f600', 'a"b']}
+        for text in [r'"\u0062ob"', r'"caf\u00e9"', '"café"', r'"\ud83d\ude00"', r'"a\u0022b"']:
+            assert validate(text, schema, chunk_size=1).done
+
+    def test_rejects_value_outside_enum(self):
+        rejects('"carol"', {'enum': ['bob', 'alice']})
+        rejects('"bo"', {'enum': ['bob']})
+        rejects('3', {'enum': [1, 2]})
+        rejects('true', {'enum': [False, None]})
+
+    def test_fails_as_soon_as_prefix_cannot_match(self):
+        validator = StreamingJSONValidator({'enum': ['bob']})
+        validator.feed('"b')
+        with pytest.raises(SchemaMismatch) as error:
+            validator.feed('x' * 1000)
+        assert 'at character 2' in str(error.value)
+
+    def test_number_and_literal_enums(self):
+        assert validate('2', {'enum': [1, 2]}).done
+        assert validate('null', {'enum': [None]}).done
+
+
+class TestNumbers:
+    @pytest.mark.parametrize('text', ['0', '-0', '10', '1.5', '-1e10', '2E-3', '1.0e+2'])
+    def test_accepts_valid_numbers(self, text):
+        assert validate(text, chunk_size=1).done
+
+    @pytest.mark.parametrize('text', ['01', '1.', '.5', '-', '+1', '1e', '1.2.3', '--1'])
+    def test_rejects_invalid_numbers(self, text):
+        rejects(text)
+
+    def test_integer_type(self):
+        assert validate('[1, -20]', {'type': 'array', 'items': {'type': 'integer'}}).done
+        rejects('1.5', {'type': 'integer'})
+        rejects('1e3', {'type': 'integer'})
+
+    def test_number_ends_at_container_boundary(self):
+        assert validate('{"a":1}', {'properties': {'a': {'type': 'number'}}}, chunk_size=1).done
+
+
+class TestNesting:
+    SCHEMA = {
+        'type': 'object',
+        'required': ['name', 'tags'],
+        'additionalProperties': False,
+        'properties': {
+            'name': {'type': 'string'},
+            'tags': {'type': 'array', 'minItems': 1, 'maxItems': 2, 'items': {'type': 'string'}},
+            'meta': {'type': 'object', 'required': ['id'], 'properties': {'id': {'type': 'integer'}}}
+        }
+    }
+
+    def test_accepts_matching_document(self):
+        text = json.dumps({'name': 'x', 'tags': ['a', 'b'], 'meta': {'id': 3, 'extra': [1]}})
+        assert validate(text, self.SCHEMA, chunk_size=1).done
+
+    @pytest.mark.parametrize('value', [
+        {'name': 'x'},
+        {'name': 'x', 'tags': []},
+        {'name': 'x', 'tags': ['a', 'b', 'c']},
+        {'name': 'x', 'tags': ['a', 1]},
+        {'name': 'x', 'tags': ['a'], 'other': 1},
+        {'name': 'x', 'tags': ['a'], 'meta': {}},
+        {'name': 'x', 'tags': ['a'], 'meta': {'id': 'one'}},
+        {'name': 1, 'tags': ['a']},
+    ])
+    def test_rejects_mismatching_document(self, value):
+        rejects(json.dumps(value), self.SCHEMA)
+
+    def test_rejects_escaped_unknown_property(self):
+        rejects(r'{"name": "x", "tags": ["a"], "\u006fther": 1}', self.SCHEMA)
+
+    def test_accepts_escaped_known_property(self):
+        assert validate(r'{"n\u0061me": "x", "t\u0061gs": ["a"]}', self.SCHEMA, chunk_size=1).done
+
+    def test_max_depth(self):
+        assert validate('[' * 64 + ']' * 64).done
+        rejects('[' * 65 + ']' * 65, error=LimitExceeded)
+        rejects('{"a":' * 65 + '1' + '}' * 65, error=LimitExceeded)
+
+    def test_max_values(self):
+        assert validate('[1, 2, 3]', max_values=4).done
+        rejects('[1, 2, 3, 4]', max_values=4, error=LimitExceeded)